@@ -1,112 +1,305 @@
 """Authentication utilities for JWT tokens and password hashing."""
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import hashlib
+import logging
+import threading
+import time
+from cachetools import TTLCache
+import jwt
+from jwt.exceptions import PyJWTError as JWTError
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHash, VerificationError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 import os
 
 from app.database import get_db
 from app.models.db_models import User
 
+logger = logging.getLogger(__name__)
+
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
+_ALGORITHMS = [ALGORITHM]
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+_DEFAULT_EXPIRE = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
+# Password hashing (OWASP argon2id baseline: 46 MiB, t=3, p=1). The env
+# overrides exist for seeding scripts and tests, where hash cost is wasted;
+# login rehashes cheaper stored hashes to the current parameters.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", str(46 * 1024)))  # KiB
+ARGON2_PARALLELISM = 1
+
+
+def _build_password_hasher() -> PasswordHasher:
+    """Build the argon2id password hasher."""
+    return PasswordHasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+    )
+
+
+password_hasher = _build_password_hasher()
+
+# Hash verified against when the account doesn't exist or the input is
+# rejected early, so every failed login costs one argon2 verify
+_DUMMY_HASH = password_hasher.hash("x" * 8)
+MAX_PASSWORD_LENGTH = 1024
+
+# OAuth2 scheme; a missing token is handled in get_current_user
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
+
+# Constant auth failures, raised as-is instead of rebuilt per request
+CREDENTIALS_EXCEPTION = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+INACTIVE_USER_EXCEPTION = HTTPException(status_code=400, detail="Inactive user")
+
+# Reused JWT encoder/decoder
+_jwt = jwt.PyJWT()
+
+# Sync dependencies run on the threadpool and TTLCache isn't thread-safe,
+# so every auth cache access goes through this lock
+_cache_lock = threading.Lock()
 
-# Password hashing
-pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+# Verified token payloads, keyed by a digest of the raw token.
+# Only successful verifications are cached.
+_token_cache = TTLCache(maxsize=10_000, ttl=60)
 
-# OAuth2 scheme
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+# Resolved users, keyed by user id, so authenticated requests skip the DB lookup.
+# Users are deactivated or deleted out of process (e.g. directly in the DB), so
+# there is nothing to invalidate from: such a user keeps authenticating for up
+# to the 30 s TTL.
+_user_cache = TTLCache(maxsize=10_000, ttl=30)
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Detached snapshot of the fields endpoints need from an authenticated User."""
+    id: int
+    email: str
+    username: str
+    full_name: Optional[str]
+    is_active: bool
+    is_superuser: bool
+
+    @classmethod
+    def from_model(cls, user) -> "CurrentUser":
+        """Build from a User instance or a row projected with _CURRENT_USER_COLUMNS."""
+        return cls(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            full_name=user.full_name,
+            is_active=bool(user.is_active),
+            is_superuser=bool(user.is_superuser),
+        )
+
+
+# Columns needed on the auth path; queried as a projection to skip ORM hydration
+_CURRENT_USER_COLUMNS = (
+    User.id,
+    User.email,
+    User.username,
+    User.full_name,
+    User.is_active,
+    User.is_superuser,
+)
+
+# Prebuilt auth-path statements
+_USER_BY_ID = select(*_CURRENT_USER_COLUMNS).where(User.id == bindparam("user_id"))
+_USER_BY_EMAIL = select(*_CURRENT_USER_COLUMNS, User.hashed_password).where(
+    User.email == bindparam("email")
+)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against a hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verify a password against a hash. Non-argon2 hashes are rejected outright."""
+    if not hashed_password or not hashed_password.startswith("$argon2"):
+        return False
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHash):
+        return False
+
+
+# argon2-cffi releases the GIL, so hashes run on the request threads; this
+# caps how many run at once so concurrent logins queue instead of pinning
+# every core
+HASH_CONCURRENCY = min(os.cpu_count() or 1, 4)
+_hash_slots = threading.BoundedSemaphore(HASH_CONCURRENCY)
+
+
+def _verify_password_limited(plain_password: str, hashed_password: str) -> bool:
+    """verify_password, holding one of the hash slots."""
+    with _hash_slots:
+        return verify_password(plain_password, hashed_password)
+
+
+def _dummy_verify(password: Optional[str]) -> None:
+    """Burn one verify's worth of time so failures take as long as a real check."""
+    _verify_password_limited((password or "x")[:MAX_PASSWORD_LENGTH], _DUMMY_HASH)
+
+
+# Login attempts per key (client IP or account email), as a token bucket
+LOGIN_BURST = 10
+LOGIN_REFILL_PER_SECOND = 10 / 60
+_login_buckets = TTLCache(maxsize=10_000, ttl=600)
+
+
+def allow_login_attempt(key: str) -> bool:
+    """Take one token from the key's bucket; False when the bucket is empty."""
+    now = time.monotonic()
+    with _cache_lock:
+        tokens, last = _login_buckets.get(key, (LOGIN_BURST, now))
+        tokens = min(LOGIN_BURST, tokens + (now - last) * LOGIN_REFILL_PER_SECOND)
+        if tokens < 1:
+            _login_buckets[key] = (tokens, now)
+            return False
+        _login_buckets[key] = (tokens - 1, now)
+    return True
 
 
 def get_password_hash(password: str) -> str:
     """Hash a password."""
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
+
+
+def _needs_stronger_hash(hashed_password: str) -> bool:
+    """
+    Whether a stored hash is weaker than the current hasher's parameters.
+
+    The cost env overrides may differ between hosts, so a hash is only
+    upgraded, never moved down to a cheaper cost.
+    """
+    try:
+        stored = extract_parameters(hashed_password)
+    except InvalidHash:
+        return True
+    current = password_hasher
+    return (
+        stored.type != current.type
+        or stored.time_cost < current.time_cost
+        or stored.memory_cost < current.memory_cost
+        or stored.parallelism < current.parallelism
+    )
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    expire = datetime.now(timezone.utc) + (expires_delta or _DEFAULT_EXPIRE)
+    to_encode["exp"] = int(expire.timestamp())
+    # Carry the numeric user id alongside the string subject so verification
+    # can use it without parsing
+    if "sub" in data:
+        to_encode["uid"] = int(data["sub"])
+    encoded_jwt = _jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def _token_cache_key(token: str) -> bytes:
+    """Hash a token into a fixed-size cache key."""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
 def decode_token(token: str) -> dict:
     """Decode and verify a JWT token."""
+    key = _token_cache_key(token)
+    with _cache_lock:
+        payload = _token_cache.get(key)
+        if payload is not None:
+            if payload.get("exp", 0) >= time.time():
+                return payload
+            _token_cache.pop(key, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _jwt.decode(token, SECRET_KEY, algorithms=_ALGORITHMS)
+        with _cache_lock:
+            _token_cache[key] = payload
         return payload
     except JWTError as e:
-        print(f"❌ JWT decode error: {type(e).__name__}: {e}")
-        print(f"🔍 SECRET_KEY being used: {SECRET_KEY[:20]}...")
+        logger.debug("JWT decode error: %s: %s", type(e).__name__, e)
         return None
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def get_current_user(token: Optional[str] = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> CurrentUser:
     """Get the current authenticated user from token."""
-    print(f"🔍 Token received: {token[:50]}..." if token else "❌ No token")
+    if not token:
+        logger.debug("No token")
+        raise CREDENTIALS_EXCEPTION
     
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Token received: %s...", token[:50])
     
     payload = decode_token(token)
     if payload is None:
-        print("❌ Token decode failed")
-        raise credentials_exception
-    
-    print(f"✅ Token decoded: {payload}")
+        logger.debug("Token decode failed")
+        raise CREDENTIALS_EXCEPTION
     
-    user_id_str: str = payload.get("sub")
-    if user_id_str is None:
-        print("❌ No 'sub' in token payload")
-        raise credentials_exception
+    user_id = payload.get("uid")
+    if user_id is None:
+        # Tokens issued before 'uid' was added only carry 'sub'; this fallback
+        # can go once those have expired (ACCESS_TOKEN_EXPIRE_MINUTES)
+        try:
+            user_id = int(payload["sub"])
+        except (KeyError, TypeError, ValueError):
+            logger.debug("Missing or invalid 'sub' in token payload")
+            raise CREDENTIALS_EXCEPTION
+    if type(user_id) is not int:
+        logger.debug("Invalid 'uid' in token payload")
+        raise CREDENTIALS_EXCEPTION
     
-    # Convert string user_id back to int
-    try:
-        user_id = int(user_id_str)
-    except (ValueError, TypeError):
-        print(f"❌ Invalid user_id format: {user_id_str}")
-        raise credentials_exception
-    
-    print(f"🔍 Looking for user_id: {user_id}")
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        print(f"❌ User not found: {user_id}")
-        raise credentials_exception
+    with _cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    db_user = db.execute(_USER_BY_ID, {"user_id": user_id}).first()
+    if db_user is None:
+        logger.debug("User not found: %s", user_id)
+        raise CREDENTIALS_EXCEPTION
     
-    print(f"✅ User found: {user.email}")
+    user = CurrentUser.from_model(db_user)
+    with _cache_lock:
+        _user_cache[user_id] = user
     return user
 
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+def get_current_active_user(current_user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
     """Get the current active user."""
     if not current_user.is_active:
-        raise HTTPException(status_code=400, detail="Inactive user")
+        raise INACTIVE_USER_EXCEPTION
     return current_user
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    """Authenticate a user by email and password."""
-    user = db.query(User).filter(User.email == email).first()
+def authenticate_user(db: Session, email: str, password: str) -> Optional[Row]:
+    """Authenticate a user by email and password. Blocking; call from a sync endpoint."""
+    if not password or len(password) > MAX_PASSWORD_LENGTH:
+        _dummy_verify(password)
+        return None
+    
+    user = db.execute(_USER_BY_EMAIL, {"email": email}).first()
     if not user:
+        _dummy_verify(password)
         return None
-    if not verify_password(password, user.hashed_password):
+    if not _verify_password_limited(password, user.hashed_password):
         return None
+    
+    # Lazily upgrade stored hashes weaker than the current argon2 parameters
+    if _needs_stronger_hash(user.hashed_password):
+        with _hash_slots:
+            new_hash = get_password_hash(password)
+        db.execute(update(User).where(User.id == user.id).values(hashed_password=new_hash))
+        db.commit()
     return user
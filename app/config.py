@@ -1,18 +1,28 @@
 """Application configuration."""
 
 import os
+from pathlib import Path
 from typing import Optional
 
+from dotenv import load_dotenv
+
+# Read .env before any setting below is evaluated
+load_dotenv()
+
 
 class Settings:
     """Application settings."""
     
-    # Database
+    # Database (defaults to data/ under the project root, whatever the cwd)
     DATABASE_URL: str = os.getenv(
         "DATABASE_URL", 
-        "sqlite:///./data/usage_revenue.db"
+        f"sqlite:///{Path(__file__).parent.parent / 'data' / 'usage_revenue.db'}"
     )
     
+    # Cache (in-process when unset)
+    REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
+    DASHBOARD_CACHE_TTL: int = int(os.getenv("DASHBOARD_CACHE_TTL", "300"))
+    
     # External Services
     OPENAI_API_KEY: Optional[str] = os.getenv("OPENAI_API_KEY")
     OPENAI_ORG_ID: Optional[str] = os.getenv("OPENAI_ORG_ID")
@@ -20,9 +30,20 @@ class Settings:
     
     # Scheduler
     SYNC_INTERVAL_HOURS: int = int(os.getenv("SYNC_INTERVAL_HOURS", "1"))
-    AGGREGATION_HOUR: int = int(os.getenv("AGGREGATION_HOUR", "2"))  # 2 AM
+    AGGREGATION_HOUR: int = int(os.getenv("AGGREGATION_HOUR", "2"))  # 2 AM, weekly full rebuild
+    AGGREGATION_REFRESH_MINUTES: int = int(os.getenv("AGGREGATION_REFRESH_MINUTES", "10"))
     INSIGHT_INTERVAL_HOURS: int = int(os.getenv("INSIGHT_INTERVAL_HOURS", "6"))
     
+    # Level for the app.* loggers
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    
+    # Server
+    HOST: str = os.getenv("HOST", "0.0.0.0")
+    PORT: int = int(os.getenv("PORT", "8000"))
+    
+    # Credential encryption (falls back to a key file under data/)
+    ENCRYPTION_KEY: Optional[str] = os.getenv("ENCRYPTION_KEY")
+    
     # API
     API_VERSION: str = "2.0.0"
     CORS_ORIGINS: list = [
@@ -0,0 +1,39 @@
+"""Encryption helpers for stored service credentials."""
+from typing import Any, Dict
+import json
+
+from cryptography.fernet import Fernet
+
+from app.config import settings
+from app.database import DB_DIR
+
+# Used when ENCRYPTION_KEY isn't set, so credentials stay decryptable across restarts
+KEY_FILE = DB_DIR / ".encryption_key"
+
+
+def _load_key() -> bytes:
+    """Read the Fernet key from ENCRYPTION_KEY, or from (creating if needed) KEY_FILE."""
+    key = settings.ENCRYPTION_KEY
+    if key:
+        return key.encode()
+
+    if KEY_FILE.exists():
+        return KEY_FILE.read_bytes().strip()
+
+    key = Fernet.generate_key()
+    KEY_FILE.write_bytes(key)
+    KEY_FILE.chmod(0o600)
+    return key
+
+
+cipher = Fernet(_load_key())
+
+
+def encrypt_credentials(credentials: Dict[str, Any]) -> str:
+    """Encrypt a credentials dict for storage."""
+    return cipher.encrypt(json.dumps(credentials).encode()).decode()
+
+
+def decrypt_credentials(token: str) -> Dict[str, Any]:
+    """Decrypt credentials produced by encrypt_credentials."""
+    return json.loads(cipher.decrypt(token.encode()))
@@ -1,26 +1,65 @@
 """Database configuration and session management."""
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, delete, event, func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os
 from pathlib import Path
 
-# Get the project root directory
-BASE_DIR = Path(__file__).resolve().parent.parent
+from app.config import settings
+
+# Get the project root directory (module __file__ is already absolute)
+BASE_DIR = Path(__file__).parent.parent
 
 # Create database directory if it doesn't exist
 DB_DIR = BASE_DIR / "data"
-DB_DIR.mkdir(exist_ok=True)
+if not DB_DIR.exists():
+    DB_DIR.mkdir(parents=True, exist_ok=True)
+
+# SQLite by default (under DB_DIR); see app.config
+DATABASE_URL = settings.DATABASE_URL
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
-# SQLite database URL
-DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_DIR}/usage_revenue.db")
+# Sync endpoints and dependencies run on Starlette's threadpool (anyio's
+# default of 40 threads), each holding a session for the whole request
+THREADPOOL_SIZE = 40
 
 # Create engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-    echo=False  # Set to True for SQL query logging
-)
+if IS_SQLITE:
+    engine = create_engine(
+        DATABASE_URL,
+        # Wait up to 30s on a locked database instead of failing immediately
+        connect_args={"check_same_thread": False, "timeout": 30},
+        # Keep a set of long-lived connections so their page caches stay warm,
+        # with overflow so every threadpool worker can still get one
+        pool_size=8,
+        max_overflow=THREADPOOL_SIZE,
+        echo=False  # Set to True for SQL query logging
+    )
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=20,
+        max_overflow=10,
+        pool_timeout=30,
+        pool_pre_ping=True,  # Drop connections the server closed while idle
+        pool_recycle=1800,
+        echo=False
+    )
+
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _connection_record):
+        """Use WAL so readers don't block the writer, and relax fsync per commit."""
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+        cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB
+        cursor.close()
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -29,6 +68,18 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# Dialect-specific INSERT constructs that support ON CONFLICT
+_DIALECT_INSERTS = {
+    "postgresql": pg_insert,
+    "sqlite": sqlite_insert,
+}
+
+
+def dialect_insert(db, model):
+    """INSERT for a model on the session's dialect, with on_conflict_do_* support."""
+    return _DIALECT_INSERTS[db.get_bind().dialect.name](model)
+
+
 def get_db():
     """Dependency for getting database sessions."""
     db = SessionLocal()
@@ -38,7 +89,42 @@ def get_db():
         db.close()
 
 
+# Indexes earlier versions of the models created and the current ones replace
+_SUPERSEDED_INDEXES = (
+    "idx_daily_date_customer",
+    "idx_daily_date_feature",
+    "idx_usage_ts_qty",
+    "idx_rev_ts_amount",
+    "idx_usage_ts_customer_covering",
+    "idx_usage_ts_feature_covering",
+    "idx_insight_active_severity",
+)
+
+
+def _dedupe_daily_aggregates(connection, model) -> None:
+    """
+    Keep only the newest row per (date, customer) and per (date, feature),
+    so the unique upsert indexes can be built on a database that predates them.
+    """
+    for key, other in ((model.customer_id, model.feature), (model.feature, model.customer_id)):
+        newest = select(func.max(model.id)).where(other.is_(None)).group_by(model.date, key)
+        connection.execute(delete(model).where(other.is_(None), model.id.notin_(newest)))
+
+
 def init_db():
     """Initialize database tables."""
-    from app.models.db_models import Customer, UsageEvent, RevenueEvent, DailyAggregate, InsightFlag
+    from app.models.db_models import Customer, UsageEvent, RevenueEvent, DailyAggregate, CustomerTotal, DailySummary, RefreshState, InsightFlag
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist; bring the indexes of
+    # databases created before them up to date
+    with engine.begin() as connection:
+        for name in _SUPERSEDED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+        existing = {index["name"] for index in inspect(connection).get_indexes(DailyAggregate.__tablename__)}
+        if not {"uq_daily_date_customer", "uq_daily_date_feature"} <= existing:
+            _dedupe_daily_aggregates(connection, DailyAggregate)
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
@@ -1,42 +1,56 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, Request
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import datetime, timedelta
-import os
-from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from datetime import date, datetime, timedelta
+import hashlib
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+from types import MappingProxyType
+from typing import Mapping, Tuple
+import orjson
+from cachetools import TTLCache, cached
+from sqlalchemy import or_, select
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
 
 from app.services.aggregation_service import AggregationService
 from app.services.data_ingestion_service import DataIngestionService
-from app.services.scheduler_service import SchedulerService
 from app.services.airbyte_service import AirbyteService, airbyte_service
-from app.models import DashboardData
-from app.database import get_db, init_db
+from app.services.cache_service import dashboard_cache
+from app.models import CustomersResponse, DashboardResponse
+from app.config import settings
+from app.database import DB_DIR, SessionLocal, get_db, init_db
+from app.crypto import encrypt_credentials
 from app.auth import (
     get_password_hash, 
     authenticate_user, 
     create_access_token, 
     get_current_active_user,
+    CurrentUser,
+    allow_login_attempt,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from app.models.db_models import User
 
-# Load environment variables
-load_dotenv()
-
 # Initialize database
 init_db()
 
-# Configuration
-ENABLE_SCHEDULER = os.getenv("ENABLE_SCHEDULER", "true").lower() == "true"
-USE_DATABASE = os.getenv("USE_DATABASE", "true").lower() == "true"
+# Configuration (read once from the environment in app.config)
+ENABLE_SCHEDULER = settings.ENABLE_SCHEDULER
+USE_DATABASE = settings.USE_DATABASE
+SQLITE_DB_PATH = str(DB_DIR / "usage_revenue.db")
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Usage vs Revenue Analyzer",
     description="Dashboard that joins usage data with billing data",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware for Next.js frontend
@@ -76,19 +90,25 @@ class Token(BaseModel):
     token_type: str
     user: UserResponse
 
-# Initialize scheduler only if enabled
-scheduler_service = SchedulerService() if ENABLE_SCHEDULER else None
+# Initialize scheduler only if enabled; API-only deployments never import APScheduler
+if ENABLE_SCHEDULER:
+    from app.services.scheduler_service import SchedulerService
+    scheduler_service = SchedulerService()
+else:
+    scheduler_service = None
 
 
 # ==================== AUTH ENDPOINTS ====================
 
 @app.post("/api/auth/register", response_model=Token)
-async def register(user_data: UserRegister, db: Session = Depends(get_db)):
+def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """Register a new user."""
     # Check if user exists
-    existing_user = db.query(User).filter(
-        (User.email == user_data.email) | (User.username == user_data.username)
-    ).first()
+    existing_user = db.execute(
+        select(User.id).where(
+            or_(User.email == user_data.email, User.username == user_data.username)
+        ).limit(1)
+    ).scalar()
     
     if existing_user:
         raise HTTPException(
@@ -125,8 +145,15 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
 
 
 @app.post("/api/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login user and return JWT token."""
+    client_ip = request.client.host if request.client else "unknown"
+    if not (allow_login_attempt(f"ip:{client_ip}") and allow_login_attempt(f"account:{form_data.username.lower()}")):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts, try again later"
+        )
+    
     user = authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
@@ -151,7 +178,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
 
 
 @app.get("/api/auth/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_active_user)):
+async def get_me(current_user: CurrentUser = Depends(get_current_active_user)):
     """Get current user info."""
     return {
         "id": current_user.id,
@@ -162,12 +189,34 @@ async def get_me(current_user: User = Depends(get_current_active_user)):
     }
 
 
-# Initialize scheduler only if enabled
+# Service loggers hand records to a queue drained by a background thread,
+# so request handlers never block writing to stderr
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, _log_handler, respect_handler_level=True
+)
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup."""
+    # The queue is the app loggers' only output; propagating to root as well
+    # would log records twice, or drop INFO at root's default WARNING level
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.LOG_LEVEL)
+    app_logger.propagate = False
+    app_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    _log_listener.start()
+
+    # Databases materialized before daily_summaries existed need their rollups built once
+    db = SessionLocal()
+    try:
+        AggregationService(db).backfill_daily_summaries()
+    finally:
+        db.close()
+
     # Initialize Airbyte
     try:
         await airbyte_service.initialize()
@@ -187,103 +236,181 @@ async def shutdown_event():
     if ENABLE_SCHEDULER and scheduler_service:
         scheduler_service.shutdown()
         print("✅ Background scheduler stopped")
+    
+    airbyte_service.close()
+    _log_listener.stop()
+
+
+# Health payloads never change after startup, so serialize them once
+_HEALTH_BYTES = orjson.dumps({"status": "healthy", "version": "2.0.0"})
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "version": "2.0.0"}
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 @app.get("/api/health")
 async def api_health_check():
     """API health check endpoint for frontend"""
-    return {
-        "status": "healthy",
-        "version": "2.0.0",
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
-@app.get("/api/health")
-async def api_health_check():
-    """API health check endpoint for frontend"""
-    return {
-        "status": "healthy",
-        "version": "2.0.0",
-        "timestamp": datetime.utcnow().isoformat()
-    }
 
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 
-@app.get("/api/dashboard")
-async def get_dashboard_data(
-    request: Request,
-    start_date: str = Query(None),
-    end_date: str = Query(None),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
-):
-    """
-    Get aggregated dashboard data for the specified date range.
-    Now powered by the database layer for efficient querying.
-    
-    If dates are not provided, defaults to last 30 days.
-    """
-    # Debug: Log authorization header
-    auth_header = request.headers.get('Authorization')
-    print(f"🔍 Dashboard request - Auth header: {auth_header[:50] if auth_header else 'NONE'}")
-    
+
+@cached(TTLCache(maxsize=1, ttl=1), lock=threading.Lock())
+def _default_date_range() -> tuple:
+    """Last 30 days as (start, end) YYYY-MM-DD strings, recomputed at most once a second."""
+    now = datetime.now()
+    return (now - timedelta(days=30)).date().isoformat(), now.date().isoformat()
+
+
+def _is_valid_date(value: str) -> bool:
+    """Check a YYYY-MM-DD string without building a datetime via strptime."""
+    if not _DATE_RE.match(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _resolve_date_range(start_date: str, end_date: str) -> tuple:
+    """Apply the 30-day default and validate the requested date range."""
     # Default to last 30 days if not specified
-    if not end_date:
-        end_date = datetime.now().strftime('%Y-%m-%d')
-    if not start_date:
-        start = datetime.now() - timedelta(days=30)
-        start_date = start.strftime('%Y-%m-%d')
+    if not start_date or not end_date:
+        default_start, default_end = _default_date_range()
+        start_date = start_date or default_start
+        end_date = end_date or default_end
     
     # Validate dates
-    try:
-        datetime.strptime(start_date, '%Y-%m-%d')
-        datetime.strptime(end_date, '%Y-%m-%d')
-    except ValueError:
+    if not (_is_valid_date(start_date) and _is_valid_date(end_date)):
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
+    return start_date, end_date
+
+
+def _load_dashboard(start_date: str, end_date: str, db: Session, nocache: bool = False) -> dict:
+    """Resolve the date range and return (possibly cached) dashboard data."""
+    start_date, end_date = _resolve_date_range(start_date, end_date)
+    
+    # Shared by the dashboard, features and timeseries endpoints; cleared after a sync
+    if not nocache:
+        cached_data = dashboard_cache.get(start_date, end_date)
+        if cached_data is not None:
+            return cached_data
+    
     try:
         # Use database aggregation service
         aggregation_service = AggregationService(db)
         dashboard_data = aggregation_service.get_dashboard_data(start_date, end_date)
-        
-        return dashboard_data
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    
+    dashboard_cache.set(start_date, end_date, dashboard_data)
+    return dashboard_data
+
+
+# Endpoints below return pre-serialized Responses, so their response_model
+# only documents the schema; FastAPI doesn't re-validate or re-encode the body.
+
+# Browsers may reuse GET payloads briefly and revalidate with If-None-Match
+_CACHE_CONTROL = "private, max-age=30, stale-while-revalidate=60"
+
+
+def _cacheable_response(request: Request, payload: dict) -> Response:
+    """
+    Serialize payload once and tag it with a weak ETag of the body.
+    Returns 304 without a body when the client already holds that version.
+    """
+    body = orjson.dumps(payload)
+    etag = 'W/"' + hashlib.blake2s(body, digest_size=8).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": _CACHE_CONTROL}
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/dashboard", response_model=DashboardResponse)
+def get_dashboard_data(
+    request: Request,
+    start_date: str = Query(None),
+    end_date: str = Query(None),
+    nocache: bool = Query(False),
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_active_user)
+):
+    """
+    Get aggregated dashboard data for the specified date range.
+    Now powered by the database layer for efficient querying.
+    
+    If dates are not provided, defaults to last 30 days.
+    Pass nocache=1 to bypass the short-lived result cache.
+    """
+    return _cacheable_response(request, _load_dashboard(start_date, end_date, db, nocache))
 
 
 @app.get("/api/features")
-async def get_features(
+def get_features(
+    request: Request,
     start_date: str = Query(None),
     end_date: str = Query(None),
+    nocache: bool = Query(False),
     db: Session = Depends(get_db)
 ):
     """Get feature metrics only"""
-    dashboard_data = await get_dashboard_data(start_date, end_date, db)
-    return {
-        "features": dashboard_data['feature_metrics'],
-        "summary": dashboard_data['summary']
-    }
+    start_date, end_date = _resolve_date_range(start_date, end_date)
+    
+    dashboard_data = None if nocache else dashboard_cache.get(start_date, end_date)
+    if dashboard_data is not None:
+        return _cacheable_response(request, {
+            "features": dashboard_data['feature_metrics'],
+            "summary": dashboard_data['summary']
+        })
+    
+    try:
+        aggregation_service = AggregationService(db)
+        return _cacheable_response(request, {
+            "features": aggregation_service.get_feature_metrics(start_date, end_date),
+            "summary": aggregation_service.get_summary(start_date, end_date)
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
 
 
 @app.get("/api/timeseries")
-async def get_timeseries(
+def get_timeseries(
+    request: Request,
     start_date: str = Query(None),
     end_date: str = Query(None),
+    nocache: bool = Query(False),
     db: Session = Depends(get_db)
 ):
     """Get time-series metrics only"""
-    dashboard_data = await get_dashboard_data(start_date, end_date, db)
-    return {
-        "timeseries": dashboard_data['time_series']
-    }
+    start_date, end_date = _resolve_date_range(start_date, end_date)
+    
+    dashboard_data = None if nocache else dashboard_cache.get(start_date, end_date)
+    if dashboard_data is not None:
+        return _cacheable_response(request, {
+            "timeseries": dashboard_data['time_series']
+        })
+    
+    try:
+        aggregation_service = AggregationService(db)
+        return _cacheable_response(request, {
+            "timeseries": aggregation_service.get_time_series(start_date, end_date)
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
 
 
 @app.get("/api/insights")
-async def get_insights(db: Session = Depends(get_db)):
+def get_insights(db: Session = Depends(get_db)):
     """Get active rule-based insights."""
     try:
         aggregation_service = AggregationService(db)
@@ -296,19 +423,19 @@ async def get_insights(db: Session = Depends(get_db)):
 @app.post("/api/sync")
 async def trigger_sync(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    current_user: CurrentUser = Depends(get_current_active_user)
 ):
     """Manually trigger Airbyte sync for all configured connections."""
     try:
         ingestion_service = DataIngestionService(db)
         stats = await ingestion_service.sync_from_airbyte()
         
-        # Materialize aggregates
+        # Materialize aggregates (blocking DB work, kept off the event loop)
         aggregation_service = AggregationService(db)
-        agg_count = aggregation_service.materialize_daily_aggregates(datetime.now())
+        agg_count = await run_in_threadpool(aggregation_service.materialize_daily_aggregates, datetime.now())
         
         # Compute insights
-        insight_count = aggregation_service.compute_insights()
+        insight_count = await run_in_threadpool(aggregation_service.compute_insights)
         
         return {
             "status": "success",
@@ -321,8 +448,9 @@ async def trigger_sync(
         raise HTTPException(status_code=500, detail=f"Sync failed: {str(e)}")
 
 
-@app.get("/api/customers")
-async def get_customers(
+@app.get("/api/customers", response_model=CustomersResponse)
+def get_customers(
+    request: Request,
     limit: int = Query(50, ge=1, le=100),
     db: Session = Depends(get_db)
 ):
@@ -331,42 +459,74 @@ async def get_customers(
     from sqlalchemy import func
     
     try:
+        # Sum each event table per customer on its own; joining both tables
+        # before grouping multiplies usage rows by revenue rows
+        usage_sub = db.query(
+            UsageEvent.customer_id,
+            func.sum(UsageEvent.quantity).label('usage')
+        ).group_by(UsageEvent.customer_id).subquery()
+        revenue_sub = db.query(
+            RevenueEvent.customer_id,
+            func.sum(RevenueEvent.amount).label('revenue')
+        ).group_by(RevenueEvent.customer_id).subquery()
+        
+        total_usage = func.coalesce(usage_sub.c.usage, 0.0)
+        total_revenue = func.coalesce(revenue_sub.c.revenue, 0.0)
         customers = db.query(
             Customer.id,
             Customer.external_customer_id,
             Customer.name,
             Customer.plan,
-            func.sum(UsageEvent.quantity).label('total_usage'),
-            func.sum(RevenueEvent.amount).label('total_revenue')
+            total_usage.label('total_usage'),
+            total_revenue.label('total_revenue'),
+            # Customers without usage divide by 1, matching the previous Python math
+            (total_revenue / func.coalesce(func.nullif(usage_sub.c.usage, 0), 1.0)).label('revenue_per_unit')
         ).outerjoin(
-            UsageEvent, Customer.id == UsageEvent.customer_id
+            usage_sub, Customer.id == usage_sub.c.customer_id
         ).outerjoin(
-            RevenueEvent, Customer.id == RevenueEvent.customer_id
-        ).group_by(
-            Customer.id,
-            Customer.external_customer_id,
-            Customer.name,
-            Customer.plan
-        ).limit(limit).all()
+            revenue_sub, Customer.id == revenue_sub.c.customer_id
+        ).limit(limit)
         
-        return {
+        return _cacheable_response(request, {
             "customers": [
                 {
                     "id": c.id,
                     "external_id": c.external_customer_id,
                     "name": c.name,
                     "plan": c.plan,
-                    "usage": float(c.total_usage or 0),
-                    "revenue": float(c.total_revenue or 0),
-                    "revenue_per_unit": float(c.total_revenue or 0) / float(c.total_usage or 1)
+                    "usage": c.total_usage,
+                    "revenue": c.total_revenue,
+                    "revenue_per_unit": c.revenue_per_unit
                 }
                 for c in customers
             ]
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching customers: {str(e)}")
 
 
+# Credential fields each service needs; anything unlisted just needs an API key
+REQUIRED_FIELDS: Mapping[str, Tuple[str, ...]] = MappingProxyType({
+    'stripe': ('api_key',),
+    'openai': ('api_key',),
+    'chargebee': ('api_key', 'site'),
+    'paddle': ('api_key', 'vendor_id'),
+    'recurly': ('api_key', 'subdomain'),
+    'braintree': ('merchant_id', 'public_key', 'private_key'),
+    'anthropic': ('api_key',),
+    'aws': ('access_key_id', 'secret_access_key', 'region'),
+    'datadog': ('api_key', 'app_key'),
+})
+_DEFAULT_REQUIRED_FIELDS = ('api_key',)
+
+
+def _check_required_fields(service_type: str, credentials: dict) -> None:
+    """Raise a 400 listing any required credential fields that are missing."""
+    missing = [f for f in REQUIRED_FIELDS.get(service_type, _DEFAULT_REQUIRED_FIELDS) if not credentials.get(f)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing required fields: {', '.join(missing)}")
+
+
 @app.post("/api/test-service")
 async def test_service_connection(request: dict):
     """Test service credentials (validation only - Airbyte handles actual connections)."""
@@ -377,42 +537,22 @@ async def test_service_connection(request: dict):
         raise HTTPException(status_code=400, detail="service_type and credentials required")
     
     # Basic validation - Airbyte will do the real connection test
-    required_fields = {
-        'stripe': ['api_key'],
-        'openai': ['api_key'],
-        'chargebee': ['api_key', 'site'],
-        'paddle': ['api_key', 'vendor_id'],
-        'recurly': ['api_key', 'subdomain'],
-        'braintree': ['merchant_id', 'public_key', 'private_key'],
-        'anthropic': ['api_key'],
-        'aws': ['access_key_id', 'secret_access_key', 'region'],
-        'datadog': ['api_key', 'app_key'],
-    }
-    
-    fields = required_fields.get(service_type, ['api_key'])
-    missing = [f for f in fields if not credentials.get(f)]
-    
-    if missing:
-        raise HTTPException(status_code=400, detail=f"Missing required fields: {', '.join(missing)}")
+    _check_required_fields(service_type, credentials)
     
     return {"success": True, "message": f"{service_type.title()} credentials validated"}
 
 
-@app.post("/api/settings")
-async def save_settings(request: dict):
+@app.post("/api/settings", status_code=204, include_in_schema=False, deprecated=True)
+async def save_settings():
     """Save API settings - deprecated, use /api/services instead."""
-    return {
-        "success": True,
-        "message": "Please use /api/services endpoint to add integrations",
-        "deprecated": True
-    }
+    return Response(status_code=204)
 
 
 @app.get("/api/airbyte/connections")
 async def list_airbyte_connections():
     """List all Airbyte connections."""
     try:
-        connections = airbyte_service.list_connections()
+        connections = await run_in_threadpool(airbyte_service.list_connections)
         return {"success": True, "connections": connections}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list connections: {str(e)}")
@@ -422,7 +562,7 @@ async def list_airbyte_connections():
 async def trigger_airbyte_sync(connection_id: str):
     """Manually trigger an Airbyte sync."""
     try:
-        success = airbyte_service.trigger_sync(connection_id)
+        success = await run_in_threadpool(airbyte_service.trigger_sync, connection_id)
         if success:
             return {"success": True, "message": f"Sync triggered for connection {connection_id}"}
         else:
@@ -435,21 +575,21 @@ async def trigger_airbyte_sync(connection_id: str):
 async def get_airbyte_connection_status(connection_id: str):
     """Get status of an Airbyte connection."""
     try:
-        status = airbyte_service.get_connection_status(connection_id)
+        status = await run_in_threadpool(airbyte_service.get_connection_status, connection_id)
         return {"success": True, "status": status}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get status: {str(e)}")
 
 
 @app.get("/api/services")
-async def list_services(db: Session = Depends(get_db)):
+def list_services(request: Request, db: Session = Depends(get_db)):
     """List all configured services."""
     from app.models.db_models import ServiceConfiguration
     import json
     
     try:
         services = db.query(ServiceConfiguration).all()
-        return {
+        return _cacheable_response(request, {
             "services": [
                 {
                     "id": str(svc.id),
@@ -459,21 +599,20 @@ async def list_services(db: Session = Depends(get_db)):
                     "status": svc.status,
                     "airbyte_source_id": svc.airbyte_source_id,
                     "airbyte_connection_id": svc.airbyte_connection_id,
-                    "last_sync": svc.last_sync.isoformat() if svc.last_sync else None,
+                    "last_sync": svc.last_sync,
                 }
                 for svc in services
             ]
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list services: {str(e)}")
 
 
 @app.post("/api/services")
-async def add_service(request: dict, db: Session = Depends(get_db)):
+def add_service(request: dict, db: Session = Depends(get_db)):
     """Add a new billing service and create Airbyte connection."""
     from app.models.db_models import ServiceConfiguration
     import json
-    from cryptography.fernet import Fernet
     
     service_category = request.get('service_category', 'revenue')  # Default to revenue for backward compatibility
     service_type = request.get('service_type')
@@ -483,59 +622,57 @@ async def add_service(request: dict, db: Session = Depends(get_db)):
     if not service_type or not credentials:
         raise HTTPException(status_code=400, detail="service_type and credentials required")
     
+    _check_required_fields(service_type, credentials)
+    
     try:
-        # Simple encryption (in production, use proper key management)
-        key = os.getenv("ENCRYPTION_KEY", Fernet.generate_key()).encode() if isinstance(os.getenv("ENCRYPTION_KEY", Fernet.generate_key()), str) else Fernet.generate_key()
-        cipher = Fernet(key)
-        encrypted_credentials = cipher.encrypt(json.dumps(credentials).encode()).decode()
+        encrypted_credentials = encrypt_credentials(credentials)
         
-        # Create database record
-        service_config = ServiceConfiguration(
-            service_category=service_category,
-            service_type=service_type,
-            service_name=service_name or service_type.title(),
-            api_key_encrypted=encrypted_credentials,
-            additional_config=json.dumps(credentials),
-            status="pending"
-        )
-        db.add(service_config)
-        db.commit()
-        db.refresh(service_config)
-        
-        # Create Airbyte source
+        # Build the Airbyte pipeline first so the record is written in a
+        # single transaction, without holding a write lock across HTTP calls
         source_id = airbyte_service.create_generic_source(
             service_type=service_type,
             service_name=service_name or service_type.title(),
             credentials=credentials
         )
         
+        dest_id = None
+        conn_id = None
         if source_id:
             # Create destination and connection
-            db_path = os.path.abspath("data/usage_revenue.db")
+            db_path = SQLITE_DB_PATH
             dest_id = airbyte_service.create_database_destination(db_path)
             
             if dest_id:
                 conn_id = airbyte_service.create_connection(source_id, dest_id)
-                
-                # Update service config
-                service_config.airbyte_source_id = source_id
-                service_config.airbyte_connection_id = conn_id
-                service_config.status = "active" if conn_id else "error"
-                db.commit()
-                
-                return {
-                    "success": True,
-                    "message": f"Service '{service_name}' added successfully with Airbyte pipeline",
-                    "service_id": service_config.id,
-                    "airbyte_connection_id": conn_id
-                }
         
-        service_config.status = "error"
+        # Create database record
+        service_config = ServiceConfiguration(
+            service_category=service_category,
+            service_type=service_type,
+            service_name=service_name or service_type.title(),
+            api_key_encrypted=encrypted_credentials,
+            additional_config=json.dumps(credentials),
+            airbyte_source_id=source_id if dest_id else None,
+            airbyte_connection_id=conn_id,
+            status="active" if conn_id else "error"
+        )
+        db.add(service_config)
+        db.flush()
+        service_id = service_config.id
         db.commit()
+        
+        if dest_id:
+            return {
+                "success": True,
+                "message": f"Service '{service_name}' added successfully with Airbyte pipeline",
+                "service_id": service_id,
+                "airbyte_connection_id": conn_id
+            }
+        
         return {
             "success": False,
             "message": f"Service added but Airbyte connection failed",
-            "service_id": service_config.id
+            "service_id": service_id
         }
         
     except Exception as e:
@@ -544,7 +681,7 @@ async def add_service(request: dict, db: Session = Depends(get_db)):
 
 
 @app.delete("/api/services/{service_id}")
-async def delete_service(service_id: int, db: Session = Depends(get_db)):
+def delete_service(service_id: int, db: Session = Depends(get_db)):
     """Delete a configured service."""
     from app.models.db_models import ServiceConfiguration
     
@@ -562,32 +699,7 @@ async def delete_service(service_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to delete service: {str(e)}")
 
 
-@app.post("/api/test-service")
-async def test_service_connection(request: dict):
-    """Test connection to a billing service."""
-    service_type = request.get('service_type')
-    credentials = request.get('credentials', {})
-    
-    # Simple validation - in production, actually test the API
-    if not credentials.get('api_key'):
-        raise HTTPException(status_code=400, detail="API key required")
-    
-    try:
-        # Here you would make actual API calls to test the connection
-        # For now, just validate the format
-        if service_type == 'stripe':
-            if not credentials['api_key'].startswith('sk_'):
-                return {"success": False, "message": "Invalid Stripe API key format"}
-        
-        return {"success": True, "message": f"{service_type.title()} connection test successful"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Connection test failed: {str(e)}")
-
-
 if __name__ == "__main__":
     import uvicorn
     
-    host = os.getenv("HOST", "0.0.0.0")
-    port = int(os.getenv("PORT", 8000))
-    
-    uvicorn.run(app, host=host, port=port)
+    uvicorn.run(app, host=settings.HOST, port=settings.PORT)
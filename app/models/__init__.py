@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 
@@ -43,3 +43,53 @@ class DashboardData(BaseModel):
     feature_metrics: List[FeatureMetrics]
     time_series: List[TimeSeriesMetrics]
     summary: dict
+
+
+class DashboardSummary(BaseModel):
+    """Totals for a dashboard date range"""
+    total_usage_cost: float
+    total_revenue: float
+    total_profit: float
+    profit_margin_percentage: float
+    date_range: Dict[str, str]
+
+
+class TimeSeriesPoint(BaseModel):
+    """One day of the dashboard time series"""
+    date: str
+    usage_cost: float
+    revenue: float
+    profit: float
+
+
+class FeatureMetric(BaseModel):
+    """Per-feature totals for the dashboard"""
+    feature_name: str
+    usage_count: int
+    total_cost: float
+    revenue: float
+    profit_margin: float
+
+
+class DashboardResponse(BaseModel):
+    """Response body of /api/dashboard"""
+    summary: DashboardSummary
+    time_series: List[TimeSeriesPoint]
+    feature_metrics: List[FeatureMetric]
+    refreshed_at: Optional[str] = None  # Last aggregate refresh (ISO 8601, UTC)
+
+
+class CustomerRow(BaseModel):
+    """A customer with usage and revenue totals"""
+    id: int
+    external_id: str
+    name: str
+    plan: Optional[str] = None
+    usage: float
+    revenue: float
+    revenue_per_unit: float
+
+
+class CustomersResponse(BaseModel):
+    """Response body of /api/customers"""
+    customers: List[CustomerRow]
@@ -22,6 +22,10 @@ class User(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+# Plans matching this are reported as legacy by compute_insights
+LEGACY_PLAN_PATTERN = '%legacy%'
+
+
 class Customer(Base):
     """Customer entity - maps usage + revenue to the same entity."""
     __tablename__ = "customers"
@@ -40,6 +44,15 @@ class Customer(Base):
     daily_aggregates = relationship("DailyAggregate", back_populates="customer")
     insight_flags = relationship("InsightFlag", back_populates="customer")
 
+    __table_args__ = (
+        # Partial index holding only legacy-plan customers; a leading-wildcard
+        # LIKE can't use a regular index
+        Index(
+            'idx_customer_legacy', 'id',
+            sqlite_where=plan.like(LEGACY_PLAN_PATTERN), postgresql_where=plan.like(LEGACY_PLAN_PATTERN)
+        ),
+    )
+
 
 class UsageEvent(Base):
     """Aggregatable usage data from various sources."""
@@ -60,6 +73,9 @@ class UsageEvent(Base):
     __table_args__ = (
         Index('idx_usage_customer_timestamp', 'customer_id', 'timestamp'),
         Index('idx_usage_feature_timestamp', 'feature', 'timestamp'),
+        # Covering index for the per-day (customer, feature) sums in
+        # materialize_daily_aggregates: a timestamp range scan with no table lookups
+        Index('idx_usage_ts_customer_feature_covering', 'timestamp', 'customer_id', 'feature', 'quantity', 'unit_cost'),
     )
 
 
@@ -90,6 +106,7 @@ class RevenueEvent(Base):
 
     __table_args__ = (
         Index('idx_revenue_customer_timestamp', 'customer_id', 'timestamp'),
+        Index('idx_rev_ts_customer_covering', 'timestamp', 'customer_id', 'amount'),
     )
 
 
@@ -112,11 +129,69 @@ class DailyAggregate(Base):
     customer = relationship("Customer", back_populates="daily_aggregates")
 
     __table_args__ = (
-        Index('idx_daily_date_customer', 'date', 'customer_id'),
-        Index('idx_daily_date_feature', 'date', 'feature'),
+        # Covering indexes: dashboard range sums are answered from the index alone.
+        # Partial, matching the customer_id/feature IS NOT NULL dashboard predicates.
+        Index(
+            'idx_daily_date_customer_covering', 'date', 'customer_id', 'usage_total', 'revenue_total', 'cost_total',
+            sqlite_where=customer_id.isnot(None), postgresql_where=customer_id.isnot(None)
+        ),
+        Index(
+            'idx_daily_date_feature_covering', 'date', 'feature', 'usage_total', 'revenue_total', 'cost_total',
+            sqlite_where=feature.isnot(None), postgresql_where=feature.isnot(None)
+        ),
+        # Feature-leading, so the 30-day per-feature sums in compute_insights
+        # are an ordered index-only scan
+        Index(
+            'idx_daily_feature_date_covering', 'feature', 'date', 'cost_total', 'revenue_total',
+            sqlite_where=feature.isnot(None), postgresql_where=feature.isnot(None)
+        ),
+        # One row per (date, customer) and per (date, feature); partial because
+        # NULLs never conflict in a plain unique index. Targets of the upsert
+        # in materialize_daily_aggregates.
+        Index(
+            'uq_daily_date_customer', 'date', 'customer_id', unique=True,
+            sqlite_where=feature.is_(None), postgresql_where=feature.is_(None)
+        ),
+        Index(
+            'uq_daily_date_feature', 'date', 'feature', unique=True,
+            sqlite_where=customer_id.is_(None), postgresql_where=customer_id.is_(None)
+        ),
     )
 
 
+class CustomerTotal(Base):
+    """Per-customer lifetime totals, rolled up from daily aggregates."""
+    __tablename__ = "customer_totals"
+
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    usage_total = Column(Float, default=0.0)
+    revenue_total = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DailySummary(Base):
+    """Per-day totals across all customers, rolled up from daily aggregates."""
+    __tablename__ = "daily_summaries"
+
+    date = Column(DateTime, primary_key=True)
+    usage_total = Column(Float, default=0.0)
+    cost_total = Column(Float, default=0.0)
+    revenue_total = Column(Float, default=0.0)
+
+
+class RefreshState(Base):
+    """
+    Refresh watermark per raw event table: the highest event id already
+    folded into daily_aggregates. Ids only grow, so later rows are the delta.
+    compute_insights stamps an 'insights' row the same way.
+    """
+    __tablename__ = "refresh_state"
+
+    source = Column(String, primary_key=True)  # usage_events, revenue_events, insights
+    last_row_id = Column(Integer, nullable=False, default=0)
+    last_refresh_at = Column(DateTime, default=datetime.utcnow)
+
+
 class SeverityType(enum.Enum):
     """Insight severity levels."""
     INFO = "info"
@@ -153,7 +228,7 @@ class InsightFlag(Base):
     customer = relationship("Customer", back_populates="insight_flags")
 
     __table_args__ = (
-        Index('idx_insight_active_severity', 'is_active', 'severity'),
+        Index('idx_insight_active_severity_created', 'is_active', 'severity', 'created_at'),
     )
 
 
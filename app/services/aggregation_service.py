@@ -1,17 +1,124 @@
 """Aggregation service for usage and revenue data."""
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from sqlalchemy import (
+    func, and_, or_, bindparam, case, cast, column, desc, false, insert, literal, null,
+    select, table, true, union_all, update, DateTime, Integer, String
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import date as date_type, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Any, Optional, Set, Tuple
+import csv
+import functools
+import io
 import logging
+import threading
 
+from app.database import dialect_insert
+from app.services.cache_service import dashboard_cache
 from app.models.db_models import (
-    Customer, UsageEvent, RevenueEvent, DailyAggregate,
-    InsightFlag, SeverityType, InsightType
+    LEGACY_PLAN_PATTERN, Customer, UsageEvent, RevenueEvent, DailyAggregate, CustomerTotal, DailySummary,
+    RefreshState, InsightFlag, SeverityType, InsightType
 )
 
 logger = logging.getLogger(__name__)
 
+# Batches larger than this are loaded with COPY on PostgreSQL (e.g. backfills)
+COPY_THRESHOLD = 1000
+
+# Prebuilt materialization statements, bound per day with :start/:end so
+# backfills reuse one cached compilation instead of rebuilding each query.
+# Events past the refresh watermark (:usage_seq/:revenue_seq) are left to
+# refresh_daily_aggregates, so no event is counted twice.
+_DAILY_USAGE_CELLS = select(
+    UsageEvent.customer_id,
+    UsageEvent.feature,
+    func.sum(UsageEvent.quantity).label('usage_total'),
+    func.count(UsageEvent.id).label('usage_count'),
+    func.sum(UsageEvent.quantity * UsageEvent.unit_cost).label('cost_total')
+).where(
+    and_(
+        UsageEvent.timestamp >= bindparam('start'),
+        UsageEvent.timestamp < bindparam('end'),
+        UsageEvent.id <= bindparam('usage_seq')
+    )
+).group_by(UsageEvent.customer_id, UsageEvent.feature)
+
+_DAILY_REVENUE_BY_CUSTOMER = select(
+    RevenueEvent.customer_id,
+    func.sum(RevenueEvent.amount)
+).where(
+    and_(
+        RevenueEvent.timestamp >= bindparam('start'),
+        RevenueEvent.timestamp < bindparam('end'),
+        RevenueEvent.id <= bindparam('revenue_seq')
+    )
+).group_by(RevenueEvent.customer_id)
+
+# Incremental refresh: events ingested since the watermark, per day. These
+# walk the primary key range, so each run reads only the new events.
+_PENDING_USAGE_CELLS = select(
+    func.date(UsageEvent.timestamp).label('day'),
+    UsageEvent.customer_id,
+    UsageEvent.feature,
+    func.sum(UsageEvent.quantity).label('usage_total'),
+    func.count(UsageEvent.id).label('usage_count'),
+    func.sum(UsageEvent.quantity * UsageEvent.unit_cost).label('cost_total')
+).where(
+    UsageEvent.id.between(bindparam('usage_after') + 1, bindparam('usage_seq'))
+).group_by(func.date(UsageEvent.timestamp), UsageEvent.customer_id, UsageEvent.feature)
+
+_PENDING_REVENUE_BY_CUSTOMER = select(
+    func.date(RevenueEvent.timestamp).label('day'),
+    RevenueEvent.customer_id,
+    func.sum(RevenueEvent.amount).label('revenue_total'),
+    func.count(RevenueEvent.id).label('revenue_count')
+).where(
+    RevenueEvent.id.between(bindparam('revenue_after') + 1, bindparam('revenue_seq'))
+).group_by(func.date(RevenueEvent.timestamp), RevenueEvent.customer_id)
+
+# Latest event ids, i.e. the watermark a refresh advances to
+_LATEST_EVENT_IDS = select(
+    select(func.coalesce(func.max(UsageEvent.id), 0)).scalar_subquery().label('usage_seq'),
+    select(func.coalesce(func.max(RevenueEvent.id), 0)).scalar_subquery().label('revenue_seq')
+)
+
+# refresh_state source names for the watermark keys above
+_WATERMARK_SOURCES = {'usage_seq': 'usage_events', 'revenue_seq': 'revenue_events'}
+
+# refresh_state row stamped by compute_insights (last_row_id: insights created)
+INSIGHTS_STATE_SOURCE = 'insights'
+
+_DAILY_AGGREGATE_KEYS = select(
+    DailyAggregate.customer_id,
+    DailyAggregate.feature
+).where(DailyAggregate.date == bindparam('start'))
+
+
+# Aggregate writers (refresh, rebuild, day materialization) run one at a time.
+# The lock covers the scheduler and API threads of this process; the
+# database lock taken in _lock_aggregate_writes covers other processes.
+_AGGREGATE_WRITE_LOCK = threading.RLock()
+
+# pg_advisory_xact_lock key for the same purpose on PostgreSQL
+_AGGREGATE_ADVISORY_LOCK_KEY = 0x61676772  # 'aggr'
+
+
+def _serialized_aggregate_write(method):
+    """Run an aggregate-writing method under the aggregate write locks."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with _AGGREGATE_WRITE_LOCK:
+            try:
+                self._lock_aggregate_writes()
+                result = method(self, *args, **kwargs)
+                # Also ends the transaction on early returns, releasing the lock
+                self.db.commit()
+                return result
+            except Exception:
+                self.db.rollback()
+                raise
+    return wrapper
+
 
 class AggregationService:
     """Service for aggregating usage and revenue data from the database."""
@@ -19,10 +126,13 @@ class AggregationService:
     def __init__(self, db: Session):
         self.db = db
 
+    @_serialized_aggregate_write
     def materialize_daily_aggregates(self, date: datetime) -> int:
         """
-        Pre-compute daily aggregates for efficient querying.
-        This runs periodically (e.g., nightly) to update the aggregates table.
+        Recompute one day's aggregates from its raw events.
+        The scheduler keeps aggregates current with refresh_daily_aggregates;
+        this also applies any pending events, then rebuilds a single day
+        outright (e.g. after a manual sync).
         
         Args:
             date: Date to materialize aggregates for
@@ -31,100 +141,506 @@ class AggregationService:
             Number of aggregates created
         """
         start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        latest = self._latest_event_ids()
+        watermarks = self._watermarks()
+
+        # Once incremental refresh has run, apply everything pending first so
+        # the watermark can advance to the same ids the day is recomputed from
+        touched_days = {start_of_day}
+        if watermarks is not None:
+            touched_days |= self._apply_pending_events(watermarks, latest)[1]
+
+        created = self._materialize_day(start_of_day, latest)
+
+        self._refresh_customer_totals()
+        self._refresh_daily_summaries(touched_days)
+        if watermarks is not None:
+            self._save_watermarks(latest, expected=watermarks)
+
+        self.db.commit()
+
+        # Cached dashboard payloads were computed from the previous aggregates
+        dashboard_cache.clear()
+        return created
+
+    @_serialized_aggregate_write
+    def refresh_daily_aggregates(self) -> int:
+        """
+        Fold the events ingested since the last refresh into the daily
+        aggregates, adding to the stored totals instead of rescanning whole
+        days. The first run has no watermark and rebuilds everything.
+        
+        Returns:
+            Number of raw events applied
+        """
+        watermarks = self._watermarks()
+        if watermarks is None:
+            return self.rebuild_daily_aggregates()
+
+        latest = self._latest_event_ids()
+        if latest == watermarks:
+            return 0
+
+        applied, touched_days, touched_customers = self._apply_pending_events(watermarks, latest)
+
+        self._refresh_customer_totals(touched_customers)
+        self._refresh_daily_summaries(touched_days)
+        self._save_watermarks(latest, expected=watermarks)
+
+        self.db.commit()
+
+        dashboard_cache.clear()
+        return applied
+
+    def _apply_pending_events(
+        self,
+        watermarks: Dict[str, int],
+        latest: Dict[str, int]
+    ) -> Tuple[int, Set[datetime], Set[int]]:
+        """
+        Add the events between the watermarks and the latest ids to the
+        stored daily aggregates. Not committed.
+
+        Returns:
+            (number of raw events applied, days whose aggregates changed,
+            customers whose aggregates changed)
+        """
+        bounds = {
+            'usage_after': watermarks['usage_seq'],
+            'revenue_after': watermarks['revenue_seq'],
+            **latest
+        }
+        applied = 0
+
+        # [usage_total, usage_count, cost_total, revenue_total] deltas per
+        # (day, customer) and per (day, feature)
+        customer_deltas: Dict[Tuple[datetime, int], List[float]] = {}
+        feature_deltas: Dict[Tuple[datetime, str], List[float]] = {}
+        for cell in self.db.execute(_PENDING_USAGE_CELLS, bounds):
+            day = self._as_day(cell.day)
+            applied += cell.usage_count
+            for totals in (
+                customer_deltas.setdefault((day, cell.customer_id), [0.0, 0, 0.0, 0.0]),
+                feature_deltas.setdefault((day, cell.feature), [0.0, 0, 0.0, 0.0])
+            ):
+                totals[0] += cell.usage_total
+                totals[1] += cell.usage_count
+                totals[2] += cell.cost_total or 0.0
+
+        for cell in self.db.execute(_PENDING_REVENUE_BY_CUSTOMER, bounds):
+            applied += cell.revenue_count
+            totals = customer_deltas.setdefault((self._as_day(cell.day), cell.customer_id), [0.0, 0, 0.0, 0.0])
+            totals[3] += cell.revenue_total or 0.0
+
+        self._upsert_daily_aggregates(
+            [
+                {
+                    'date': day,
+                    'customer_id': customer_id,
+                    'feature': None,
+                    'usage_total': usage_total,
+                    'usage_count': usage_count,
+                    'cost_total': cost_total,
+                    'revenue_total': revenue_total
+                }
+                for (day, customer_id), (usage_total, usage_count, cost_total, revenue_total)
+                in customer_deltas.items()
+            ],
+            index_elements=['date', 'customer_id'],
+            index_where=DailyAggregate.feature.is_(None),
+            update_columns=('usage_total', 'usage_count', 'cost_total', 'revenue_total'),
+            accumulate=True
+        )
+        self._upsert_daily_aggregates(
+            [
+                {
+                    'date': day,
+                    'customer_id': None,
+                    'feature': feature,
+                    'usage_total': usage_total,
+                    'usage_count': usage_count,
+                    'cost_total': cost_total,
+                    'revenue_total': 0.0
+                }
+                for (day, feature), (usage_total, usage_count, cost_total, _) in feature_deltas.items()
+            ],
+            index_elements=['date', 'feature'],
+            index_where=DailyAggregate.customer_id.is_(None),
+            update_columns=('usage_total', 'usage_count', 'cost_total'),
+            accumulate=True
+        )
+
+        return (
+            applied,
+            {day for day, _ in customer_deltas},
+            {customer_id for _, customer_id in customer_deltas}
+        )
+
+    @_serialized_aggregate_write
+    def rebuild_daily_aggregates(self) -> int:
+        """
+        Recompute the aggregates of every day that has events and reset the
+        refresh watermarks to the latest event ids.
+        
+        Returns:
+            Number of aggregates created
+        """
+        latest = self._latest_event_ids()
+
+        first, last = None, None
+        for model in (UsageEvent, RevenueEvent):
+            low, high = self.db.execute(select(func.min(model.timestamp), func.max(model.timestamp))).one()
+            if low is not None:
+                first = low if first is None else min(first, low)
+                last = high if last is None else max(last, high)
+
+        created = 0
+        if first is not None:
+            day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day <= last:
+                created += self._materialize_day(day, latest)
+                day += timedelta(days=1)
+
+        self._refresh_customer_totals()
+        self._refresh_daily_summaries(all_days=True)
+        self._save_watermarks(latest)
+
+        self.db.commit()
+
+        dashboard_cache.clear()
+        return created
+
+    def _materialize_day(self, start_of_day: datetime, seqs: Dict[str, int]) -> int:
+        """
+        Overwrite one day's customer and feature aggregates with totals
+        recomputed from events up to the given watermark ids. Not committed.
+        
+        Returns:
+            Number of aggregates created
+        """
         end_of_day = start_of_day + timedelta(days=1)
         
         created = 0
 
-        # Aggregate by customer
-        customer_aggregates = self.db.query(
-            UsageEvent.customer_id,
-            func.sum(UsageEvent.quantity).label('usage_total'),
-            func.count(UsageEvent.id).label('usage_count'),
-            func.sum(UsageEvent.quantity * UsageEvent.unit_cost).label('cost_total')
-        ).filter(
-            and_(
-                UsageEvent.timestamp >= start_of_day,
-                UsageEvent.timestamp < end_of_day
+        # Usage per (customer, feature) in a single scan of the day's events;
+        # the customer and feature breakdowns are both folded from it
+        day = {'start': start_of_day, 'end': end_of_day, **seqs}
+        usage_cells = self.db.execute(_DAILY_USAGE_CELLS, day).all()
+
+        # [usage_total, usage_count, cost_total] per customer and per feature
+        customer_aggregates: Dict[int, List[float]] = {}
+        feature_aggregates: Dict[str, List[float]] = {}
+        for cell in usage_cells:
+            for totals in (
+                customer_aggregates.setdefault(cell.customer_id, [0.0, 0, 0.0]),
+                feature_aggregates.setdefault(cell.feature, [0.0, 0, 0.0])
+            ):
+                totals[0] += cell.usage_total
+                totals[1] += cell.usage_count
+                totals[2] += cell.cost_total or 0.0
+
+        # Revenue per customer for the day in one query instead of one per customer.
+        # Customers with revenue but no usage still get a row, as in the
+        # incremental refresh, so both paths store the same totals.
+        revenue_map = dict(self.db.execute(_DAILY_REVENUE_BY_CUSTOMER, day).all())
+        for customer_id in revenue_map:
+            customer_aggregates.setdefault(customer_id, [0.0, 0, 0.0])
+
+        # Keys already stored for the day, only needed to report how many rows are new
+        existing_keys = {
+            (row.customer_id, row.feature)
+            for row in self.db.execute(_DAILY_AGGREGATE_KEYS, day)
+        }
+
+        customer_rows = [
+            {
+                'date': start_of_day,
+                'customer_id': customer_id,
+                'feature': None,
+                'usage_total': usage_total,
+                'usage_count': usage_count,
+                'cost_total': cost_total,
+                'revenue_total': revenue_map.get(customer_id) or 0.0
+            }
+            for customer_id, (usage_total, usage_count, cost_total) in customer_aggregates.items()
+        ]
+        created += sum(1 for row in customer_rows if (row['customer_id'], None) not in existing_keys)
+        self._upsert_daily_aggregates(
+            customer_rows,
+            index_elements=['date', 'customer_id'],
+            index_where=DailyAggregate.feature.is_(None),
+            update_columns=('usage_total', 'usage_count', 'cost_total', 'revenue_total')
+        )
+
+        feature_rows = [
+            {
+                'date': start_of_day,
+                'customer_id': None,
+                'feature': feature,
+                'usage_total': usage_total,
+                'usage_count': usage_count,
+                'cost_total': cost_total,
+                'revenue_total': 0.0
+            }
+            for feature, (usage_total, usage_count, cost_total) in feature_aggregates.items()
+        ]
+        created += sum(1 for row in feature_rows if (None, row['feature']) not in existing_keys)
+        self._upsert_daily_aggregates(
+            feature_rows,
+            index_elements=['date', 'feature'],
+            index_where=DailyAggregate.customer_id.is_(None),
+            update_columns=('usage_total', 'usage_count', 'cost_total')
+        )
+
+        return created
+
+    def _watermarks(self) -> Optional[Dict[str, int]]:
+        """Stored refresh watermarks, or None before the first refresh."""
+        stored = dict(self.db.execute(select(RefreshState.source, RefreshState.last_row_id)).all())
+        if not all(source in stored for source in _WATERMARK_SOURCES.values()):
+            return None
+        return {key: stored[source] for key, source in _WATERMARK_SOURCES.items()}
+
+    def _latest_event_ids(self) -> Dict[str, int]:
+        """Highest usage and revenue event ids currently stored."""
+        return dict(self.db.execute(_LATEST_EVENT_IDS).one()._mapping)
+
+    def _lock_aggregate_writes(self) -> None:
+        """
+        Take the database-wide aggregate write lock for the rest of the
+        session's transaction, before anything is read, so watermarks and
+        event ids are read only once no other writer can move them.
+        """
+        if self.db.get_bind().dialect.name == 'postgresql':
+            self.db.execute(select(func.pg_advisory_xact_lock(_AGGREGATE_ADVISORY_LOCK_KEY)))
+        else:
+            # Any UPDATE opens SQLite's write transaction, even one matching no rows
+            self.db.execute(
+                update(RefreshState).where(false()).values(last_row_id=RefreshState.last_row_id)
             )
-        ).group_by(UsageEvent.customer_id).all()
-
-        for agg in customer_aggregates:
-            # Get revenue for this customer
-            revenue = self.db.query(
-                func.sum(RevenueEvent.amount)
-            ).filter(
-                and_(
-                    RevenueEvent.customer_id == agg.customer_id,
-                    RevenueEvent.timestamp >= start_of_day,
-                    RevenueEvent.timestamp < end_of_day
-                )
-            ).scalar() or 0.0
-
-            # Check if aggregate already exists
-            existing = self.db.query(DailyAggregate).filter(
-                and_(
-                    DailyAggregate.date == start_of_day,
-                    DailyAggregate.customer_id == agg.customer_id,
-                    DailyAggregate.feature.is_(None)
-                )
-            ).first()
-
-            if existing:
-                existing.usage_total = agg.usage_total
-                existing.usage_count = agg.usage_count
-                existing.cost_total = agg.cost_total
-                existing.revenue_total = revenue
-            else:
-                daily_agg = DailyAggregate(
-                    date=start_of_day,
-                    customer_id=agg.customer_id,
-                    usage_total=agg.usage_total,
-                    usage_count=agg.usage_count,
-                    cost_total=agg.cost_total,
-                    revenue_total=revenue
-                )
-                self.db.add(daily_agg)
-                created += 1
-
-        # Aggregate by feature
-        feature_aggregates = self.db.query(
-            UsageEvent.feature,
-            func.sum(UsageEvent.quantity).label('usage_total'),
-            func.count(UsageEvent.id).label('usage_count'),
-            func.sum(UsageEvent.quantity * UsageEvent.unit_cost).label('cost_total')
-        ).filter(
-            and_(
-                UsageEvent.timestamp >= start_of_day,
-                UsageEvent.timestamp < end_of_day
+
+    def _save_watermarks(self, seqs: Dict[str, int], expected: Optional[Dict[str, int]] = None) -> None:
+        """
+        Record the event ids aggregates now include, in the caller's transaction.
+        With expected, only move watermarks that still hold those ids
+        (compare-and-swap); raises if another writer moved them meanwhile.
+        """
+        now = datetime.utcnow()
+        if expected is None:
+            self._upsert_refresh_state([
+                {'source': source, 'last_row_id': seqs[key], 'last_refresh_at': now}
+                for key, source in _WATERMARK_SOURCES.items()
+            ])
+            return
+
+        for key, source in _WATERMARK_SOURCES.items():
+            result = self.db.execute(
+                update(RefreshState)
+                .where(and_(RefreshState.source == source, RefreshState.last_row_id == expected[key]))
+                .values(last_row_id=seqs[key], last_refresh_at=now)
             )
-        ).group_by(UsageEvent.feature).all()
-
-        for agg in feature_aggregates:
-            existing = self.db.query(DailyAggregate).filter(
-                and_(
-                    DailyAggregate.date == start_of_day,
-                    DailyAggregate.customer_id.is_(None),
-                    DailyAggregate.feature == agg.feature
-                )
-            ).first()
-
-            if existing:
-                existing.usage_total = agg.usage_total
-                existing.usage_count = agg.usage_count
-                existing.cost_total = agg.cost_total
-            else:
-                daily_agg = DailyAggregate(
-                    date=start_of_day,
-                    feature=agg.feature,
-                    usage_total=agg.usage_total,
-                    usage_count=agg.usage_count,
-                    cost_total=agg.cost_total
-                )
-                self.db.add(daily_agg)
-                created += 1
+            if result.rowcount != 1:
+                raise RuntimeError(f"{source} refresh watermark moved during the refresh")
 
+    def insights_stale(self) -> bool:
+        """Whether aggregates were refreshed since insights were last computed."""
+        refreshed_at = dict(self.db.execute(
+            select(RefreshState.source, RefreshState.last_refresh_at)
+        ).all())
+        computed_at = refreshed_at.pop(INSIGHTS_STATE_SOURCE, None)
+        if computed_at is None:
+            return True
+        return any(stamp and stamp > computed_at for stamp in refreshed_at.values())
+
+    def _upsert_refresh_state(self, rows: List[Dict[str, Any]]) -> None:
+        """Insert or update refresh_state rows, in the caller's transaction."""
+        stmt = dialect_insert(self.db, RefreshState).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['source'],
+            set_={
+                'last_row_id': stmt.excluded.last_row_id,
+                'last_refresh_at': stmt.excluded.last_refresh_at
+            }
+        )
+        self.db.execute(stmt)
+
+    @staticmethod
+    def _as_day(value: Any) -> datetime:
+        """Midnight datetime for a SQL date() result (a string on SQLite)."""
+        if isinstance(value, str):
+            value = date_type.fromisoformat(value)
+        return datetime(value.year, value.month, value.day)
+
+    def backfill_daily_summaries(self) -> None:
+        """Build daily_summaries rows for every materialized day that lacks one."""
+        self._refresh_daily_summaries()
         self.db.commit()
-        return created
+
+    def _refresh_daily_summaries(self, days: Iterable[datetime] = (), all_days: bool = False) -> None:
+        """
+        Roll the customer daily aggregates up into daily_summaries for the
+        given days (or all_days), plus any day that has aggregates but no
+        summary yet. Dashboards read these rows instead of re-summing every
+        customer.
+        """
+        days = list(days)
+        if all_days:
+            stale = true()
+        elif days:
+            stale = or_(DailyAggregate.date.in_(days), DailyAggregate.date.notin_(select(DailySummary.date)))
+        else:
+            stale = DailyAggregate.date.notin_(select(DailySummary.date))
+
+        totals = select(
+            DailyAggregate.date,
+            func.sum(DailyAggregate.usage_total),
+            func.sum(DailyAggregate.cost_total),
+            func.sum(DailyAggregate.revenue_total)
+        ).where(
+            and_(
+                DailyAggregate.customer_id.isnot(None),  # Only customer aggregates
+                stale
+            )
+        ).group_by(DailyAggregate.date)
+
+        stmt = dialect_insert(self.db, DailySummary).from_select(
+            ['date', 'usage_total', 'cost_total', 'revenue_total'], totals
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['date'],
+            set_={
+                'usage_total': stmt.excluded.usage_total,
+                'cost_total': stmt.excluded.cost_total,
+                'revenue_total': stmt.excluded.revenue_total
+            }
+        )
+        self.db.execute(stmt)
+
+    def _refresh_customer_totals(self, customer_ids: Optional[Iterable[int]] = None) -> None:
+        """
+        Recompute customer_totals from the customer daily aggregates, so
+        insights read one row per customer instead of scanning raw events.
+        Only the given customers are recomputed; None means every customer.
+        """
+        if customer_ids is None:
+            selected = true()
+        else:
+            customer_ids = list(customer_ids)
+            if not customer_ids:
+                return
+            selected = DailyAggregate.customer_id.in_(customer_ids)
+
+        totals = select(
+            DailyAggregate.customer_id,
+            func.sum(DailyAggregate.usage_total),
+            func.sum(DailyAggregate.revenue_total),
+            literal(datetime.utcnow(), DateTime)
+        ).where(
+            and_(DailyAggregate.customer_id.isnot(None), selected)
+        ).group_by(DailyAggregate.customer_id)
+
+        stmt = dialect_insert(self.db, CustomerTotal).from_select(
+            ['customer_id', 'usage_total', 'revenue_total', 'updated_at'], totals
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['customer_id'],
+            set_={
+                'usage_total': stmt.excluded.usage_total,
+                'revenue_total': stmt.excluded.revenue_total,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        self.db.execute(stmt)
+
+    def _upsert_daily_aggregates(
+        self,
+        rows: List[Dict[str, Any]],
+        index_elements: List[str],
+        index_where: Any,
+        update_columns: Tuple[str, ...],
+        accumulate: bool = False
+    ) -> None:
+        """
+        Insert daily aggregate rows, updating the ones that already exist,
+        as a single INSERT ... ON CONFLICT DO UPDATE statement.
+
+        Args:
+            rows: Column dicts for the rows to write
+            index_elements: Columns of the partial unique index to conflict on
+            index_where: Predicate of that partial unique index
+            update_columns: Columns to overwrite on conflict
+            accumulate: Add the rows' values to the stored ones instead of
+                overwriting them (incremental refresh deltas)
+        """
+        if not rows:
+            return
+
+        # copy_expert is psycopg2's API; other Postgres drivers take the upsert below
+        dialect = self.db.get_bind().dialect
+        if dialect.name == 'postgresql' and dialect.driver == 'psycopg2' and len(rows) > COPY_THRESHOLD:
+            self._bulk_upsert_copy(rows, index_elements, index_where, update_columns, accumulate)
+            return
+
+        stmt = dialect_insert(self.db, DailyAggregate)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            index_where=index_where,
+            set_=self._conflict_updates(stmt, update_columns, accumulate)
+        )
+        self.db.execute(stmt, rows)
+
+    @staticmethod
+    def _conflict_updates(stmt: Any, update_columns: Tuple[str, ...], accumulate: bool) -> Dict[str, Any]:
+        """SET clause for a daily_aggregates upsert: overwrite or add to each column."""
+        if accumulate:
+            stored = DailyAggregate.__table__.c
+            return {c: stored[c] + stmt.excluded[c] for c in update_columns}
+        return {c: stmt.excluded[c] for c in update_columns}
+
+    def _bulk_upsert_copy(
+        self,
+        rows: List[Dict[str, Any]],
+        index_elements: List[str],
+        index_where: Any,
+        update_columns: Tuple[str, ...],
+        accumulate: bool = False
+    ) -> None:
+        """
+        PostgreSQL (psycopg2) fast path for large batches: COPY the rows into a temp
+        table, then upsert into daily_aggregates with one INSERT ... SELECT.
+
+        Runs on the session's own connection and transaction, so the temp
+        table is dropped on commit.
+        """
+        columns = list(rows[0].keys())
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            # None is written as an unquoted empty field, which COPY reads as NULL
+            writer.writerow([row[c] for c in columns])
+        buf.seek(0)
+
+        raw = self.db.connection().connection
+        with raw.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS tmp_daily_aggregates")
+            cur.execute(
+                "CREATE TEMP TABLE tmp_daily_aggregates "
+                "(LIKE daily_aggregates INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cur.copy_expert(
+                f"COPY tmp_daily_aggregates ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buf
+            )
+
+        staged = table('tmp_daily_aggregates', *(column(c) for c in columns))
+        stmt = pg_insert(DailyAggregate).from_select(columns, select(*staged.c))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            index_where=index_where,
+            set_=self._conflict_updates(stmt, update_columns, accumulate)
+        )
+        self.db.execute(stmt)
 
     def compute_insights(self) -> int:
         """
@@ -133,54 +649,61 @@ class AggregationService:
         Returns:
             Number of insights generated
         """
-        # Clear old insights
-        self.db.query(InsightFlag).filter(InsightFlag.is_active == 1).update(
-            {'is_active': 0, 'resolved_at': datetime.utcnow()}
+        # Stamped before reading, so a refresh committed mid-run marks
+        # insights stale again
+        started_at = datetime.utcnow()
+
+        # Clear old insights. Everything below runs in the session's single
+        # transaction and is committed once at the end. synchronize_session=False
+        # keeps the matched flags out of the identity map.
+        self.db.execute(
+            update(InsightFlag)
+            .where(InsightFlag.is_active == 1)
+            .values(is_active=0, resolved_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
         )
 
         insights_created = 0
 
-        # Insight 1: High usage, low revenue customers
-        high_usage_customers = self.db.query(
+        # Insight 1: High usage, low revenue customers.
+        # Read from the customer_totals rollup and written with one INSERT ... SELECT.
+        high_usage_customers = select(
             Customer.id,
-            Customer.name,
-            func.sum(UsageEvent.quantity).label('total_usage'),
-            func.sum(RevenueEvent.amount).label('total_revenue')
-        ).join(
-            UsageEvent, Customer.id == UsageEvent.customer_id
-        ).outerjoin(
-            RevenueEvent, Customer.id == RevenueEvent.customer_id
-        ).group_by(
-            Customer.id, Customer.name
-        ).having(
+            literal(InsightType.LOW_REVENUE, InsightFlag.insight_type.type),
+            literal(SeverityType.CRITICAL, InsightFlag.severity.type),
+            literal('customer'),
+            literal('High Usage, Low Revenue'),
+            Customer.name
+            + ' has high usage (' + self._sql_number(CustomerTotal.usage_total, 0, grouping=True)
+            + ') but low revenue ($' + self._sql_number(CustomerTotal.revenue_total, 2) + ')',
+            'Revenue/Unit: $' + self._sql_number(CustomerTotal.revenue_total / CustomerTotal.usage_total, 4),
+            literal(1)
+        ).join_from(
+            Customer, CustomerTotal, CustomerTotal.customer_id == Customer.id
+        ).where(
             and_(
-                func.sum(UsageEvent.quantity) > 10000,
-                func.coalesce(func.sum(RevenueEvent.amount), 0) < 100
+                CustomerTotal.usage_total > 10000,
+                CustomerTotal.revenue_total < 100
             )
-        ).all()
-
-        for customer in high_usage_customers:
-            insight = InsightFlag(
-                customer_id=customer.id,
-                insight_type=InsightType.LOW_REVENUE,
-                severity=SeverityType.CRITICAL,
-                category='customer',
-                title='High Usage, Low Revenue',
-                message=f'{customer.name} has high usage ({int(customer.total_usage):,}) but low revenue (${customer.total_revenue or 0:.2f})',
-                metric_value=f'Revenue/Unit: ${(customer.total_revenue or 0) / customer.total_usage:.4f}',
-                is_active=1
+        )
+
+        result = self.db.execute(
+            insert(InsightFlag).from_select(
+                ['customer_id', 'insight_type', 'severity', 'category',
+                 'title', 'message', 'metric_value', 'is_active'],
+                high_usage_customers
             )
-            self.db.add(insight)
-            insights_created += 1
+        )
+        insights_created += result.rowcount
 
         # Insight 2: Unprofitable features
         last_30_days = datetime.utcnow() - timedelta(days=30)
         
-        unprofitable_features = self.db.query(
+        feature_totals = select(
             DailyAggregate.feature,
             func.sum(DailyAggregate.cost_total).label('total_cost'),
-            func.sum(DailyAggregate.revenue_total).label('total_revenue')
-        ).filter(
+            func.coalesce(func.sum(DailyAggregate.revenue_total), 0.0).label('total_revenue')
+        ).where(
             and_(
                 DailyAggregate.feature.isnot(None),
                 DailyAggregate.date >= last_30_days
@@ -189,43 +712,80 @@ class AggregationService:
             DailyAggregate.feature
         ).having(
             func.sum(DailyAggregate.cost_total) > func.sum(DailyAggregate.revenue_total)
-        ).all()
-
-        for feature in unprofitable_features:
-            loss = feature.total_cost - (feature.total_revenue or 0)
-            insight = InsightFlag(
-                insight_type=InsightType.UNPROFITABLE_FEATURE,
-                severity=SeverityType.CRITICAL if loss > 1000 else SeverityType.WARNING,
-                category='feature',
-                title='Unprofitable Feature',
-                message=f'Feature "{feature.feature}" costs ${feature.total_cost:.2f} but generates ${feature.total_revenue or 0:.2f}',
-                metric_value=f'Loss: ${loss:.2f}',
-                is_active=1
+        ).subquery()
+        loss = feature_totals.c.total_cost - feature_totals.c.total_revenue
+
+        unprofitable_features = select(
+            literal(InsightType.UNPROFITABLE_FEATURE, InsightFlag.insight_type.type),
+            case(
+                (loss > 1000, literal(SeverityType.CRITICAL, InsightFlag.severity.type)),
+                else_=literal(SeverityType.WARNING, InsightFlag.severity.type)
+            ),
+            literal('feature'),
+            literal('Unprofitable Feature'),
+            'Feature "' + feature_totals.c.feature
+            + '" costs $' + self._sql_number(feature_totals.c.total_cost, 2)
+            + ' but generates $' + self._sql_number(feature_totals.c.total_revenue, 2),
+            'Loss: $' + self._sql_number(loss, 2),
+            literal(1)
+        )
+
+        result = self.db.execute(
+            insert(InsightFlag).from_select(
+                ['insight_type', 'severity', 'category', 'title',
+                 'message', 'metric_value', 'is_active'],
+                unprofitable_features
             )
-            self.db.add(insight)
-            insights_created += 1
-
-        # Insight 3: Legacy plan usage
-        legacy_customers = self.db.query(Customer).filter(
-            Customer.plan.like('%legacy%')
-        ).count()
-
-        if legacy_customers > 0:
-            insight = InsightFlag(
-                insight_type=InsightType.LEGACY_PLAN,
-                severity=SeverityType.WARNING,
-                category='usage',
-                title='Legacy Plan Usage',
-                message=f'{legacy_customers} customer(s) on legacy plans',
-                metric_value=f'{legacy_customers} customers',
-                is_active=1
+        )
+        insights_created += result.rowcount
+
+        # Insight 3: Legacy plan usage, one flag when any customer matches.
+        # Same predicate as the idx_customer_legacy partial index, rendered
+        # inline (not bound) so the planner can match it and count index entries
+        legacy_count = cast(func.count(), String)
+        legacy_plan_usage = select(
+            literal(InsightType.LEGACY_PLAN, InsightFlag.insight_type.type),
+            literal(SeverityType.WARNING, InsightFlag.severity.type),
+            literal('usage'),
+            literal('Legacy Plan Usage'),
+            legacy_count + ' customer(s) on legacy plans',
+            legacy_count + ' customers',
+            literal(1)
+        ).select_from(Customer).where(
+            Customer.plan.like(literal(LEGACY_PLAN_PATTERN, literal_execute=True))
+        ).having(func.count() > 0)
+
+        result = self.db.execute(
+            insert(InsightFlag).from_select(
+                ['insight_type', 'severity', 'category', 'title',
+                 'message', 'metric_value', 'is_active'],
+                legacy_plan_usage
             )
-            self.db.add(insight)
-            insights_created += 1
+        )
+        insights_created += result.rowcount
+
+        self._upsert_refresh_state([
+            {'source': INSIGHTS_STATE_SOURCE, 'last_row_id': insights_created, 'last_refresh_at': started_at}
+        ])
 
         self.db.commit()
         return insights_created
 
+    def _sql_number(self, expr: Any, decimals: int, grouping: bool = False) -> Any:
+        """
+        Format a numeric SQL expression as text, like f'{value:,.{decimals}f}'
+        would in Python. Only the grouped form supports decimals=0.
+        """
+        if self.db.get_bind().dialect.name == 'postgresql':
+            pattern = 'FM999,999,999,999,990' if grouping else 'FM999999999999990'
+            if decimals:
+                pattern += '.' + '0' * decimals
+            return func.to_char(expr, pattern)
+        if grouping:
+            # SQLite only groups digits for integer conversions
+            return func.printf('%,d', cast(expr, Integer))
+        return func.printf(f'%.{decimals}f', expr)
+
     def get_dashboard_data(self, start_date: str, end_date: str) -> Dict[str, Any]:
         """
         Get aggregated dashboard data from the database.
@@ -234,80 +794,193 @@ class AggregationService:
         start_dt = datetime.fromisoformat(start_date)
         end_dt = datetime.fromisoformat(end_date)
 
-        # Get time series data from daily aggregates
-        time_series = self.db.query(
-            DailyAggregate.date,
+        # Daily totals and per-feature sums in one round-trip, told apart by 'kind'
+        daily = select(
+            literal('ts').label('kind'),
+            DailySummary.date.label('date'),
+            null().cast(String).label('feature'),
+            DailySummary.usage_total.label('usage_total'),
+            DailySummary.cost_total.label('cost_total'),
+            DailySummary.revenue_total.label('revenue_total')
+        ).where(
+            and_(DailySummary.date >= start_dt, DailySummary.date <= end_dt)
+        )
+        per_feature = select(
+            literal('feat').label('kind'),
+            null().cast(DateTime).label('date'),
+            DailyAggregate.feature.label('feature'),
             func.sum(DailyAggregate.usage_total).label('usage_total'),
             func.sum(DailyAggregate.cost_total).label('cost_total'),
             func.sum(DailyAggregate.revenue_total).label('revenue_total')
-        ).filter(
-            and_(
-                DailyAggregate.date >= start_dt,
-                DailyAggregate.date <= end_dt,
-                DailyAggregate.customer_id.isnot(None)  # Only customer aggregates
-            )
-        ).group_by(DailyAggregate.date).order_by(DailyAggregate.date).all()
+        ).where(
+            and_(DailyAggregate.date >= start_dt, DailyAggregate.date <= end_dt),
+            DailyAggregate.feature.isnot(None)
+        ).group_by(DailyAggregate.feature)
 
-        # Get feature metrics
-        feature_metrics = self.db.query(
+        # Feature rows (NULL date) come back highest revenue first
+        stmt = union_all(daily, per_feature).order_by('kind', 'date', desc('revenue_total'))
+
+        # Stream the rows and total the summary as they arrive
+        time_series = []
+        feature_metrics = []
+        total_usage_cost = 0.0
+        total_revenue = 0.0
+        for row in self.db.execute(stmt.execution_options(yield_per=1000)):
+            if row.kind == 'ts':
+                cost = row.cost_total or 0.0
+                revenue = row.revenue_total or 0.0
+                total_usage_cost += cost
+                total_revenue += revenue
+                time_series.append({
+                    'date': row.date.isoformat()[:10],
+                    'usage_cost': cost,
+                    'revenue': revenue,
+                    'profit': revenue - cost
+                })
+            else:
+                feature_metrics.append(row)
+
+        # Tells the UI how stale the aggregates may be; the insights row
+        # records when insights ran, not when the data was refreshed
+        refreshed_at = self.db.scalar(
+            select(func.max(RefreshState.last_refresh_at))
+            .where(RefreshState.source != INSIGHTS_STATE_SOURCE)
+        )
+
+        return {
+            'summary': self._build_summary(total_usage_cost, total_revenue, start_date, end_date),
+            'time_series': time_series,
+            'feature_metrics': self._format_feature_metrics(feature_metrics),
+            # Stored as naive UTC; tagged so browsers don't read it as local time
+            'refreshed_at': refreshed_at.replace(tzinfo=timezone.utc).isoformat() if refreshed_at else None
+        }
+
+    def get_time_series(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """Get daily cost/revenue/profit for the date range."""
+        time_series = self._query_time_series(
+            datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
+        )
+        return self._format_time_series(time_series)
+
+    def get_feature_metrics(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """Get per-feature usage, cost and revenue for the date range."""
+        return self._query_feature_metrics(
+            datetime.fromisoformat(start_date), datetime.fromisoformat(end_date)
+        )
+
+    def _query_feature_metrics(self, start_dt: datetime, end_dt: datetime) -> List[Dict[str, Any]]:
+        """Sum feature aggregates over the date range."""
+        feature_metrics = self.db.execute(select(
             DailyAggregate.feature,
-            func.sum(DailyAggregate.usage_total).label('usage_count'),
-            func.sum(DailyAggregate.cost_total).label('total_cost'),
-            func.sum(DailyAggregate.revenue_total).label('revenue')
-        ).filter(
+            func.sum(DailyAggregate.usage_total).label('usage_total'),
+            func.sum(DailyAggregate.cost_total).label('cost_total'),
+            func.sum(DailyAggregate.revenue_total).label('revenue_total')
+        ).where(
             and_(
                 DailyAggregate.date >= start_dt,
                 DailyAggregate.date <= end_dt,
                 DailyAggregate.feature.isnot(None)
             )
-        ).group_by(DailyAggregate.feature).all()
+        ).group_by(DailyAggregate.feature).order_by(desc('revenue_total'))).all()
+
+        return self._format_feature_metrics(feature_metrics)
+
+    def get_summary(self, start_date: str, end_date: str) -> Dict[str, Any]:
+        """Get cost/revenue totals for the date range in a single aggregate query."""
+        start_dt = datetime.fromisoformat(start_date)
+        end_dt = datetime.fromisoformat(end_date)
+
+        totals = self.db.execute(select(
+            func.coalesce(func.sum(DailySummary.cost_total), 0.0).label('cost_total'),
+            func.coalesce(func.sum(DailySummary.revenue_total), 0.0).label('revenue_total')
+        ).where(
+            and_(
+                DailySummary.date >= start_dt,
+                DailySummary.date <= end_dt
+            )
+        )).one()
+
+        return self._build_summary(totals.cost_total, totals.revenue_total, start_date, end_date)
+
+    def _query_time_series(self, start_dt: datetime, end_dt: datetime) -> List[Any]:
+        """Read the per-day totals over the date range."""
+        return self.db.execute(select(
+            DailySummary.date,
+            DailySummary.usage_total,
+            DailySummary.cost_total,
+            DailySummary.revenue_total
+        ).where(
+            and_(
+                DailySummary.date >= start_dt,
+                DailySummary.date <= end_dt
+            )
+        ).order_by(DailySummary.date)).all()
 
-        # Calculate summary
-        total_usage_cost = sum(ts.cost_total for ts in time_series)
-        total_revenue = sum(ts.revenue_total for ts in time_series)
+    @staticmethod
+    def _format_time_series(time_series: List[Any]) -> List[Dict[str, Any]]:
+        return [
+            {
+                'date': ts.date.isoformat()[:10],
+                'usage_cost': ts.cost_total,
+                'revenue': ts.revenue_total,
+                'profit': ts.revenue_total - ts.cost_total
+            }
+            for ts in time_series
+        ]
+
+    @staticmethod
+    def _format_feature_metrics(feature_metrics: List[Any]) -> List[Dict[str, Any]]:
+        return [
+            {
+                'feature_name': fm.feature,
+                'usage_count': int(fm.usage_total),
+                'total_cost': fm.cost_total,
+                'revenue': fm.revenue_total or 0,
+                'profit_margin': ((fm.revenue_total or 0) - fm.cost_total) / (fm.revenue_total or 1) * 100
+            }
+            for fm in feature_metrics
+        ]
+
+    @staticmethod
+    def _build_summary(total_usage_cost: float, total_revenue: float, start_date: str, end_date: str) -> Dict[str, Any]:
         total_profit = total_revenue - total_usage_cost
         profit_margin_pct = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
 
         return {
-            'summary': {
-                'total_usage_cost': total_usage_cost,
-                'total_revenue': total_revenue,
-                'total_profit': total_profit,
-                'profit_margin_percentage': profit_margin_pct,
-                'date_range': {
-                    'start': start_date,
-                    'end': end_date
-                }
-            },
-            'time_series': [
-                {
-                    'date': ts.date.strftime('%Y-%m-%d'),
-                    'usage_cost': ts.cost_total,
-                    'revenue': ts.revenue_total,
-                    'profit': ts.revenue_total - ts.cost_total
-                }
-                for ts in time_series
-            ],
-            'feature_metrics': [
-                {
-                    'feature_name': fm.feature,
-                    'usage_count': int(fm.usage_count),
-                    'total_cost': fm.total_cost,
-                    'revenue': fm.revenue or 0,
-                    'profit_margin': ((fm.revenue or 0) - fm.total_cost) / (fm.revenue or 1) * 100
-                }
-                for fm in feature_metrics
-            ]
+            'total_usage_cost': total_usage_cost,
+            'total_revenue': total_revenue,
+            'total_profit': total_profit,
+            'profit_margin_percentage': profit_margin_pct,
+            'date_range': {
+                'start': start_date,
+                'end': end_date
+            }
         }
 
     def get_active_insights(self) -> List[Dict[str, Any]]:
-        """Get all active insights."""
-        insights = self.db.query(InsightFlag).filter(
-            InsightFlag.is_active == 1
-        ).order_by(
-            InsightFlag.severity.desc(),
-            InsightFlag.created_at.desc()
-        ).all()
+        """Get all active insights, most severe first."""
+        # Enum columns store member names, so ordering by severity itself is
+        # alphabetical; rank by criticality explicitly instead
+        severity_rank = case(
+            (InsightFlag.severity == SeverityType.CRITICAL, 0),
+            (InsightFlag.severity == SeverityType.WARNING, 1),
+            else_=2
+        )
+        insights = self.db.execute(
+            select(
+                InsightFlag.id,
+                InsightFlag.severity,
+                InsightFlag.category,
+                InsightFlag.title,
+                InsightFlag.message,
+                InsightFlag.metric_value
+            ).where(
+                InsightFlag.is_active == 1
+            ).order_by(
+                severity_rank,
+                InsightFlag.created_at.desc()
+            )
+        )
 
         return [
             {
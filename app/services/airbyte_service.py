@@ -2,9 +2,142 @@
 Airbyte Integration Service
 Manages connections to third-party services via Airbyte
 """
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+import orjson
 import requests
-from typing import Dict, Any, Optional, List
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, Optional, List, Tuple
+from urllib3.util import Retry
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive pool sizing for the shared session; every request goes to one
+# Airbyte host, so pool_maxsize bounds the concurrent connections
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 64
+
+# Connection failures are retried for every method since nothing reached the
+# server. Read errors and 429/5xx are retried only for idempotent methods
+# (urllib3's default), because these POSTs create sources, connections and jobs.
+_RETRY = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    backoff_factor=0.3,
+    status_forcelist=(429, 502, 503, 504),
+    respect_retry_after_header=True
+)
+
+# Known Airbyte source definition IDs
+# These are the official Airbyte connector IDs
+_SOURCE_DEFINITION_IDS = MappingProxyType({
+    # Revenue Services
+    "stripe": "e094cb9a-26de-4645-8761-65c0c425d1de",
+    "chargebee": "9b2d3607-7222-4709-9fa2-c2abdebbdd88",
+    "paddle": "d1aa448b-7c54-498e-ad96-b9fdbe4c9e44",
+    "recurly": "dfd93f08-0e34-48e2-8d1f-3b22d5d8a9f8",
+    "braintree": "aefd9a0c-e6e8-4f36-9cf5-4f7e92e7e6c6",
+    "custom-revenue": "b76be0a6-27dc-4560-95f6-2623da0bd7b6",
+
+    # Usage Services
+    "openai": "custom-http-source",  # Would need custom connector
+    "anthropic": "custom-http-source",
+    "aws": "4d46b5b9-7b4f-41c0-8e4e-0d6f6c6a8f8e",  # AWS CloudWatch
+    "datadog": "3e9c5e0c-7c4e-4c4e-8c4e-4c4e4c4e4c4e",
+    "custom-usage": "b76be0a6-27dc-4560-95f6-2623da0bd7b6"
+})
+
+# Known destination definition IDs
+_DESTINATION_DEFINITION_IDS = MappingProxyType({
+    "sqlite": "b76be0a6-27dc-4560-95f6-2623da0bd7b6",
+    "postgres": "25c5221d-dce2-4163-ade9-739ef790f503"
+})
+
+# Service-specific connection configuration mappings
+_CONFIG_BUILDERS = MappingProxyType({
+    # Revenue Services
+    "stripe": lambda c: {
+        "client_secret": c.get("api_key"),
+        "account_id": c.get("account_id", ""),
+        "start_date": "2024-01-01T00:00:00Z"
+    },
+    "chargebee": lambda c: {
+        "api_key": c.get("api_key"),
+        "site": c.get("site"),
+        "start_date": "2024-01-01T00:00:00Z"
+    },
+    "paddle": lambda c: {
+        "api_key": c.get("api_key"),
+        "vendor_id": c.get("vendor_id")
+    },
+    "recurly": lambda c: {
+        "api_key": c.get("api_key"),
+        "subdomain": c.get("subdomain"),
+        "begin_time": "2024-01-01T00:00:00Z"
+    },
+    "braintree": lambda c: {
+        "merchant_id": c.get("merchant_id"),
+        "public_key": c.get("public_key"),
+        "private_key": c.get("private_key"),
+        "environment": "sandbox"
+    },
+    "custom-revenue": lambda c: {
+        "api_key": c.get("api_key"),
+        "base_url": c.get("base_url"),
+        "account_id": c.get("account_id", "")
+    },
+
+    # Usage Services
+    "openai": lambda c: {
+        "api_key": c.get("api_key"),
+        "org_id": c.get("org_id", ""),
+        "base_url": "https://api.openai.com/v1"
+    },
+    "anthropic": lambda c: {
+        "api_key": c.get("api_key"),
+        "base_url": "https://api.anthropic.com/v1"
+    },
+    "aws": lambda c: {
+        "access_key_id": c.get("access_key_id"),
+        "secret_access_key": c.get("secret_access_key"),
+        "region": c.get("region", "us-east-1")
+    },
+    "datadog": lambda c: {
+        "api_key": c.get("api_key"),
+        "app_key": c.get("app_key"),
+        "site": c.get("site", "datadoghq.com")
+    },
+    "custom-usage": lambda c: {
+        "api_key": c.get("api_key"),
+        "base_url": c.get("base_url"),
+        "account_id": c.get("account_id", "")
+    }
+})
+
+
+# Fixed request-body fields, serialized once at import as the inside of a JSON
+# object (no opening brace); _splice_json appends them to the per-call fields
+_CONNECTION_STATIC_FIELDS = orjson.dumps({
+    "name": "Stripe to Database",
+    "namespaceDefinition": "destination",
+    "namespaceFormat": "${SOURCE_NAMESPACE}",
+    "status": "active",
+    "schedule": {
+        "units": 1,
+        "timeUnit": "hours"
+    }
+})[1:]
+_SYNC_JOB_STATIC_FIELDS = orjson.dumps({"jobType": "sync"})[1:]
+
+
+def _splice_json(fields: Dict[str, Any], static_fields: bytes) -> bytes:
+    """Serialize the per-call fields and join them with pre-serialized static ones"""
+    return orjson.dumps(fields)[:-1] + b"," + static_fields
 
 
 class AirbyteService:
@@ -25,45 +158,103 @@ class AirbyteService:
         }
         if self.api_key:
             self.headers["Authorization"] = f"Bearer {self.api_key}"
+        
+        # One pooled keep-alive session for every call to the Airbyte server.
+        # Sized so sync_from_airbyte's concurrent triggers don't queue for a
+        # connection; overflow opens a throwaway connection rather than blocking.
+        # Transient failures are retried here rather than in each method.
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE,
+            pool_block=False,
+            max_retries=_RETRY
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # Connection metadata changes rarely but is polled by the UI;
+        # methods run on the threadpool, so cache access is locked
+        self._metadata_cache = TTLCache(maxsize=256, ttl=30)
+        self._cache_lock = threading.Lock()
+        
+        # Runs independent requests side by side on the pooled session
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="airbyte")
+    
+    def close(self):
+        """Close pooled connections to the Airbyte server"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+    
+    def _cached_get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Tuple[int, Any]:
+        """GET a read-only metadata endpoint through a short-lived cache
+        
+        Only successful responses are cached.
+        
+        Args:
+            path: API path under the server URL
+            params: Query parameters
+            
+        Returns:
+            (status code, parsed JSON body on 200 or response text otherwise)
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._cache_lock:
+            data = self._metadata_cache.get(key)
+        if data is not None:
+            return 200, data
+        
+        response = self.session.get(f"{self.server_url}{path}", params=params, timeout=10)
+        if response.status_code != 200:
+            return response.status_code, response.text
+        
+        data = orjson.loads(response.content)
+        with self._cache_lock:
+            self._metadata_cache[key] = data
+        return 200, data
+    
+    def _invalidate_metadata_cache(self):
+        """Drop cached metadata after a write changes it"""
+        with self._cache_lock:
+            self._metadata_cache.clear()
     
     async def initialize(self):
         """Initialize and get or create workspace"""
         try:
             # Try to list workspaces
-            response = requests.get(
+            response = self.session.get(
                 f"{self.server_url}/v1/workspaces",
-                headers=self.headers,
                 timeout=5
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 workspaces = data.get('data', [])
                 
                 if workspaces:
                     self.workspace_id = workspaces[0].get('workspaceId')
                 else:
                     # Create workspace
-                    create_response = requests.post(
+                    create_response = self.session.post(
                         f"{self.server_url}/v1/workspaces",
-                        headers=self.headers,
-                        json={
+                        data=orjson.dumps({
                             "name": "Usage-Revenue-Analyzer",
                             "email": os.getenv("ADMIN_EMAIL", "admin@example.com")
-                        },
+                        }),
                         timeout=5
                     )
                     if create_response.status_code == 200:
-                        self.workspace_id = create_response.json().get('workspaceId')
+                        self.workspace_id = orjson.loads(create_response.content).get('workspaceId')
                 
                 return self.workspace_id is not None
             
             # Airbyte not available yet, that's okay
-            print("Airbyte server not available - will connect later")
+            logger.warning("Airbyte server not available - will connect later")
             return False
             
         except Exception as e:
-            print(f"Airbyte connection note: {e}")
+            logger.warning(f"Airbyte connection note: {e}")
             return False
     
     def create_stripe_source(self, api_key: str, account_id: str) -> Optional[str]:
@@ -77,30 +268,29 @@ class AirbyteService:
             Source ID if successful, None otherwise
         """
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.server_url}/v1/sources",
-                headers=self.headers,
-                json={
+                data=orjson.dumps({
                     "workspaceId": self.workspace_id,
                     "name": "Stripe Revenue",
-                    "sourceDefinitionId": "e094cb9a-26de-4645-8761-65c0c425d1de",  # Stripe
+                    "sourceDefinitionId": _SOURCE_DEFINITION_IDS["stripe"],
                     "connectionConfiguration": {
                         "client_secret": api_key,
                         "account_id": account_id,
                         "start_date": "2024-01-01T00:00:00Z"
                     }
-                },
+                }),
                 timeout=10
             )
             
             if response.status_code == 200:
-                return response.json().get('sourceId')
+                return orjson.loads(response.content).get('sourceId')
             else:
-                print(f"Failed to create Stripe source: {response.text}")
+                logger.warning(f"Failed to create Stripe source: {response.text}")
                 return None
                 
         except Exception as e:
-            print(f"Failed to create Stripe source: {e}")
+            logger.warning("Failed to create Stripe source: %s", e)
             return None
     
     def create_openai_source(self, api_key: str, org_id: str) -> Optional[str]:
@@ -118,7 +308,7 @@ class AirbyteService:
         """
         # For now, return None as OpenAI doesn't have native connector
         # You'd need to create a custom connector or use HTTP API source
-        print("OpenAI source creation - custom connector needed")
+        logger.info("OpenAI source creation - custom connector needed")
         return None
     
     def create_database_destination(self, db_path: str) -> Optional[str]:
@@ -131,28 +321,27 @@ class AirbyteService:
             Destination ID if successful, None otherwise
         """
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.server_url}/v1/destinations",
-                headers=self.headers,
-                json={
+                data=orjson.dumps({
                     "workspaceId": self.workspace_id,
                     "name": "Local Database",
-                    "destinationDefinitionId": "b76be0a6-27dc-4560-95f6-2623da0bd7b6",  # SQLite
+                    "destinationDefinitionId": _DESTINATION_DEFINITION_IDS["sqlite"],
                     "connectionConfiguration": {
                         "destination_path": db_path
                     }
-                },
+                }),
                 timeout=10
             )
             
             if response.status_code == 200:
-                return response.json().get('destinationId')
+                return orjson.loads(response.content).get('destinationId')
             else:
-                print(f"Failed to create destination: {response.text}")
+                logger.warning(f"Failed to create destination: {response.text}")
                 return None
                 
         except Exception as e:
-            print(f"Failed to create database destination: {e}")
+            logger.warning("Failed to create database destination: %s", e)
             return None
     
     def create_connection(
@@ -172,32 +361,24 @@ class AirbyteService:
             Connection ID if successful, None otherwise
         """
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.server_url}/v1/connections",
-                headers=self.headers,
-                json={
-                    "sourceId": source_id,
-                    "destinationId": destination_id,
-                    "name": "Stripe to Database",
-                    "namespaceDefinition": "destination",
-                    "namespaceFormat": "${SOURCE_NAMESPACE}",
-                    "status": "active",
-                    "schedule": {
-                        "units": 1,
-                        "timeUnit": "hours"
-                    }
-                },
+                data=_splice_json(
+                    {"sourceId": source_id, "destinationId": destination_id},
+                    _CONNECTION_STATIC_FIELDS
+                ),
                 timeout=10
             )
             
             if response.status_code == 200:
-                return response.json().get('connectionId')
+                self._invalidate_metadata_cache()
+                return orjson.loads(response.content).get('connectionId')
             else:
-                print(f"Failed to create connection: {response.text}")
+                logger.warning(f"Failed to create connection: {response.text}")
                 return None
                 
         except Exception as e:
-            print(f"Failed to create connection: {e}")
+            logger.warning("Failed to create connection: %s", e)
             return None
     
     def trigger_sync(self, connection_id: str) -> bool:
@@ -210,20 +391,20 @@ class AirbyteService:
             True if sync triggered successfully
         """
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.server_url}/v1/jobs",
-                headers=self.headers,
-                json={
-                    "connectionId": connection_id,
-                    "jobType": "sync"
-                },
+                data=_splice_json({"connectionId": connection_id}, _SYNC_JOB_STATIC_FIELDS),
                 timeout=10
             )
             
-            return response.status_code == 200
+            if response.status_code != 200:
+                return False
+            
+            self._invalidate_metadata_cache()
+            return True
             
         except Exception as e:
-            print(f"Failed to trigger sync: {e}")
+            logger.warning("Failed to trigger sync: %s", e)
             return False
     
     def get_connection_status(self, connection_id: str) -> Dict[str, Any]:
@@ -236,26 +417,22 @@ class AirbyteService:
             Dictionary with connection status details
         """
         try:
-            response = requests.get(
-                f"{self.server_url}/v1/connections/{connection_id}",
-                headers=self.headers,
+            # The latest-job lookup doesn't depend on the connection response,
+            # so issue it alongside instead of after it (always fresh, never cached)
+            jobs_future = self._executor.submit(
+                self.session.get,
+                f"{self.server_url}/v1/jobs",
+                params={"connectionId": connection_id, "limit": 1},
                 timeout=10
             )
+            status_code, connection = self._cached_get(f"/v1/connections/{connection_id}")
             
-            if response.status_code == 200:
-                connection = response.json()
-                
-                # Get latest job for this connection
-                jobs_response = requests.get(
-                    f"{self.server_url}/v1/jobs",
-                    headers=self.headers,
-                    params={"connectionId": connection_id, "limit": 1},
-                    timeout=10
-                )
+            if status_code == 200:
+                jobs_response = jobs_future.result()
                 
                 latest_job = None
                 if jobs_response.status_code == 200:
-                    jobs = jobs_response.json().get('data', [])
+                    jobs = orjson.loads(jobs_response.content).get('data', [])
                     latest_job = jobs[0] if jobs else None
                 
                 return {
@@ -265,10 +442,10 @@ class AirbyteService:
                     "records_synced": latest_job.get('rowsSynced', 0) if latest_job else 0
                 }
             else:
-                return {"status": "error", "error": f"HTTP {response.status_code}"}
+                return {"status": "error", "error": f"HTTP {status_code}"}
                 
         except Exception as e:
-            print(f"Failed to get connection status: {e}")
+            logger.warning("Failed to get connection status: %s", e)
             return {"status": "error", "error": str(e)}
     
     def list_connections(self) -> List[Dict[str, Any]]:
@@ -278,15 +455,13 @@ class AirbyteService:
             List of connection details
         """
         try:
-            response = requests.get(
-                f"{self.server_url}/v1/connections",
-                headers=self.headers,
-                params={"workspaceId": self.workspace_id},
-                timeout=10
+            status_code, body = self._cached_get(
+                "/v1/connections",
+                params={"workspaceId": self.workspace_id}
             )
             
-            if response.status_code == 200:
-                connections = response.json().get('data', [])
+            if status_code == 200:
+                connections = body.get('data', [])
                 return [
                     {
                         "id": conn.get('connectionId'),
@@ -298,11 +473,11 @@ class AirbyteService:
                     for conn in connections
                 ]
             else:
-                print(f"Failed to list connections: {response.text}")
+                logger.warning(f"Failed to list connections: {body}")
                 return []
                 
         except Exception as e:
-            print(f"Failed to list connections: {e}")
+            logger.warning("Failed to list connections: %s", e)
             return []
     
     def create_generic_source(
@@ -324,33 +499,32 @@ class AirbyteService:
         source_definition_id = self._get_source_definition_id(service_type)
         
         if not source_definition_id:
-            print(f"No Airbyte connector found for {service_type}")
+            logger.warning(f"No Airbyte connector found for {service_type}")
             return None
         
         # Build connection configuration based on service type
         connection_config = self._build_connection_config(service_type, credentials)
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.server_url}/v1/sources",
-                headers=self.headers,
-                json={
+                data=orjson.dumps({
                     "workspaceId": self.workspace_id,
                     "name": service_name,
                     "sourceDefinitionId": source_definition_id,
                     "connectionConfiguration": connection_config
-                },
+                }),
                 timeout=10
             )
             
             if response.status_code == 200:
-                return response.json().get('sourceId')
+                return orjson.loads(response.content).get('sourceId')
             else:
-                print(f"Failed to create {service_type} source: {response.text}")
+                logger.warning(f"Failed to create {service_type} source: {response.text}")
                 return None
                 
         except Exception as e:
-            print(f"Failed to create {service_type} source: {e}")
+            logger.warning("Failed to create %s source: %s", service_type, e)
             return None
     
     def _build_connection_config(
@@ -367,75 +541,15 @@ class AirbyteService:
         Returns:
             Formatted connection configuration
         """
-        # Service-specific configuration mappings
-        config_builders = {
-            # Revenue Services
-            "stripe": lambda c: {
-                "client_secret": c.get("api_key"),
-                "account_id": c.get("account_id", ""),
-                "start_date": "2024-01-01T00:00:00Z"
-            },
-            "chargebee": lambda c: {
-                "api_key": c.get("api_key"),
-                "site": c.get("site"),
-                "start_date": "2024-01-01T00:00:00Z"
-            },
-            "paddle": lambda c: {
-                "api_key": c.get("api_key"),
-                "vendor_id": c.get("vendor_id")
-            },
-            "recurly": lambda c: {
-                "api_key": c.get("api_key"),
-                "subdomain": c.get("subdomain"),
-                "begin_time": "2024-01-01T00:00:00Z"
-            },
-            "braintree": lambda c: {
-                "merchant_id": c.get("merchant_id"),
-                "public_key": c.get("public_key"),
-                "private_key": c.get("private_key"),
-                "environment": "sandbox"
-            },
-            "custom-revenue": lambda c: {
-                "api_key": c.get("api_key"),
-                "base_url": c.get("base_url"),
-                "account_id": c.get("account_id", "")
-            },
-            
-            # Usage Services
-            "openai": lambda c: {
-                "api_key": c.get("api_key"),
-                "org_id": c.get("org_id", ""),
-                "base_url": "https://api.openai.com/v1"
-            },
-            "anthropic": lambda c: {
-                "api_key": c.get("api_key"),
-                "base_url": "https://api.anthropic.com/v1"
-            },
-            "aws": lambda c: {
-                "access_key_id": c.get("access_key_id"),
-                "secret_access_key": c.get("secret_access_key"),
-                "region": c.get("region", "us-east-1")
-            },
-            "datadog": lambda c: {
-                "api_key": c.get("api_key"),
-                "app_key": c.get("app_key"),
-                "site": c.get("site", "datadoghq.com")
-            },
-            "custom-usage": lambda c: {
-                "api_key": c.get("api_key"),
-                "base_url": c.get("base_url"),
-                "account_id": c.get("account_id", "")
-            }
-        }
-        
-        builder = config_builders.get(service_type)
+        builder = _CONFIG_BUILDERS.get(service_type)
         if builder:
             return builder(credentials)
         
         # Default: pass through credentials
         return credentials
     
-    def _get_source_definition_id(self, source_name: str) -> str:
+    @staticmethod
+    def _get_source_definition_id(source_name: str) -> str:
         """Get the definition ID for a source type
         
         Args:
@@ -444,27 +558,10 @@ class AirbyteService:
         Returns:
             Source definition ID
         """
-        # Known Airbyte source definition IDs
-        # These are the official Airbyte connector IDs
-        known_ids = {
-            # Revenue Services
-            "stripe": "e094cb9a-26de-4645-8761-65c0c425d1de",
-            "chargebee": "9b2d3607-7222-4709-9fa2-c2abdebbdd88",
-            "paddle": "d1aa448b-7c54-498e-ad96-b9fdbe4c9e44",
-            "recurly": "dfd93f08-0e34-48e2-8d1f-3b22d5d8a9f8",
-            "braintree": "aefd9a0c-e6e8-4f36-9cf5-4f7e92e7e6c6",
-            "custom-revenue": "b76be0a6-27dc-4560-95f6-2623da0bd7b6",
-            
-            # Usage Services
-            "openai": "custom-http-source",  # Would need custom connector
-            "anthropic": "custom-http-source",
-            "aws": "4d46b5b9-7b4f-41c0-8e4e-0d6f6c6a8f8e",  # AWS CloudWatch
-            "datadog": "3e9c5e0c-7c4e-4c4e-8c4e-4c4e4c4e4c4e",
-            "custom-usage": "b76be0a6-27dc-4560-95f6-2623da0bd7b6"
-        }
-        return known_ids.get(source_name, "")
+        return _SOURCE_DEFINITION_IDS.get(source_name, "")
     
-    def _get_destination_definition_id(self, destination_name: str) -> str:
+    @staticmethod
+    def _get_destination_definition_id(destination_name: str) -> str:
         """Get the definition ID for a destination type
         
         Args:
@@ -473,13 +570,9 @@ class AirbyteService:
         Returns:
             Destination definition ID
         """
-        # Known destination definition IDs
-        known_ids = {
-            "sqlite": "b76be0a6-27dc-4560-95f6-2623da0bd7b6",
-            "postgres": "25c5221d-dce2-4163-ade9-739ef790f503"
-        }
-        return known_ids.get(destination_name, "")
+        return _DESTINATION_DEFINITION_IDS.get(destination_name, "")
 
 
-# Global instance
+# Global instance; import this rather than constructing AirbyteService so
+# every request handler shares one connection pool and metadata cache
 airbyte_service = AirbyteService()
@@ -0,0 +1,90 @@
+"""Response cache for dashboard payloads."""
+from typing import Any, Dict, Optional
+import logging
+import threading
+
+import orjson
+from cachetools import TTLCache
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DashboardCache:
+    """
+    Caches dashboard payloads by date range.
+
+    Backed by Redis when REDIS_URL is set, so every worker shares entries and
+    a sync invalidates them everywhere. Falls back to an in-process TTL cache.
+    """
+
+    KEY_PREFIX = "dash:"
+    KEY_VERSION = "v2"
+
+    def __init__(self, redis_url: Optional[str] = None, ttl: int = 300):
+        """Initialize the cache
+
+        Args:
+            redis_url: Redis connection URL, or None for in-process caching
+            ttl: Seconds an entry stays valid
+        """
+        self.ttl = ttl
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+            except ImportError:
+                logger.warning("redis package not installed; using in-process dashboard cache")
+
+        self._local = TTLCache(maxsize=64, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _key(self, start_date: str, end_date: str) -> str:
+        return f"{self.KEY_PREFIX}{start_date}:{end_date}:{self.KEY_VERSION}"
+
+    def get(self, start_date: str, end_date: str) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for a date range, or None on a miss."""
+        key = self._key(start_date, end_date)
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(key)
+            except Exception as e:
+                logger.warning(f"Dashboard cache read failed: {e}")
+                return None
+            return orjson.loads(raw) if raw is not None else None
+
+        with self._lock:
+            return self._local.get(key)
+
+    def set(self, start_date: str, end_date: str, payload: Dict[str, Any]) -> None:
+        """Store the payload for a date range."""
+        key = self._key(start_date, end_date)
+        if self._redis is not None:
+            try:
+                self._redis.set(key, orjson.dumps(payload), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Dashboard cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._local[key] = payload
+
+    def clear(self) -> None:
+        """Drop every cached dashboard payload."""
+        if self._redis is not None:
+            try:
+                keys = list(self._redis.scan_iter(f"{self.KEY_PREFIX}*"))
+                if keys:
+                    self._redis.delete(*keys)
+            except Exception as e:
+                logger.warning(f"Dashboard cache clear failed: {e}")
+            return
+
+        with self._lock:
+            self._local.clear()
+
+
+# Global instance
+dashboard_cache = DashboardCache(redis_url=settings.REDIS_URL, ttl=settings.DASHBOARD_CACHE_TTL)
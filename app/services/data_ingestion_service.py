@@ -1,13 +1,82 @@
 """Service for ingesting and normalizing data from external sources."""
+from sqlalchemy import func, insert, select
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
+from decimal import Decimal
 from typing import List, Dict, Any
+import asyncio
 import logging
+import fastjsonschema
 
+from app.database import dialect_insert
 from app.models.db_models import Customer, UsageEvent, RevenueEvent, EventType
 
 logger = logging.getLogger(__name__)
 
+# Rows per multi-VALUES INSERT, well under SQLite's bound-parameter limit
+INSERT_BATCH_SIZE = 500
+
+# Airbyte sync triggers in flight at once during sync_from_airbyte
+SYNC_CONCURRENCY = 8
+
+# Upper-cased event_type name -> member, built once for the revenue ingest loop
+_EVENT_TYPES = dict(EventType.__members__)
+
+# Record shapes accepted by the ingest methods, compiled once into validators.
+# timestamp is a datetime, not a JSON type, so it isn't constrained here.
+USAGE_RECORD_SCHEMA = {
+    'type': 'object',
+    'required': ['customer_id', 'feature', 'quantity'],
+    'properties': {
+        'customer_id': {'type': ['string', 'integer']},
+        'customer_name': {'type': 'string'},
+        'feature': {'type': 'string'},
+        'quantity': {'type': 'number'},
+        'unit_cost': {'type': 'number'},
+        'source': {'type': 'string'},
+    },
+}
+
+REVENUE_RECORD_SCHEMA = {
+    'type': 'object',
+    'required': ['customer_id', 'amount', 'event_type', 'external_id'],
+    'properties': {
+        'customer_id': {'type': ['string', 'integer']},
+        'customer_name': {'type': 'string'},
+        'amount': {'type': 'number'},
+        'currency': {'type': 'string'},
+        'event_type': {'type': 'string'},
+        'external_id': {'type': 'string'},
+    },
+}
+
+_validate_usage_record = fastjsonschema.compile(USAGE_RECORD_SCHEMA)
+_validate_revenue_record = fastjsonschema.compile(REVENUE_RECORD_SCHEMA)
+
+
+def _valid_records(records: List[Dict[str, Any]], validate, kind: str) -> List[Dict[str, Any]]:
+    """
+    Drop (and log) records that don't match their schema. Decimal amounts
+    are read as floats and integer customer ids are stringified, as the
+    customer and event columns stored them before validation existed.
+    """
+    valid = []
+    for record in records:
+        if isinstance(record, dict):
+            record = {k: float(v) if isinstance(v, Decimal) else v for k, v in record.items()}
+        try:
+            validate(record)
+        except fastjsonschema.JsonSchemaException as e:
+            logger.error(f"Error ingesting {kind} record: {e.message}")
+            continue
+        record['customer_id'] = str(record['customer_id'])
+        valid.append(record)
+
+    rejected = len(records) - len(valid)
+    if rejected:
+        logger.warning(f"Rejected {rejected} of {len(records)} {kind} records")
+    return valid
+
 
 class DataIngestionService:
     """Handles ingestion of usage and revenue data into the database."""
@@ -34,36 +103,28 @@ class DataIngestionService:
         Returns:
             Number of records ingested
         """
-        ingested = 0
+        usage_records = _valid_records(usage_records, _validate_usage_record, 'usage')
+        try:
+            customer_ids = self._resolve_customers(usage_records, plan_from_record=True)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error resolving customers for usage records: {e}")
+            return 0
+        # One ingestion time for the whole batch, for records without a timestamp
+        now = datetime.utcnow()
+        rows = []
         
         for record in usage_records:
-            try:
-                # Get or create customer
-                customer = self._get_or_create_customer(
-                    external_id=record['customer_id'],
-                    name=record.get('customer_name', record['customer_id']),
-                    plan=record.get('plan', 'Unknown')
-                )
-
-                # Create usage event
-                usage_event = UsageEvent(
-                    customer_id=customer.id,
-                    feature=record['feature'],
-                    quantity=record['quantity'],
-                    unit_cost=record.get('unit_cost', 0.0),
-                    timestamp=record.get('timestamp', datetime.utcnow()),
-                    source=record.get('source', 'api')
-                )
-                
-                self.db.add(usage_event)
-                ingested += 1
-                
-            except Exception as e:
-                logger.error(f"Error ingesting usage record: {e}")
-                continue
+            rows.append({
+                'customer_id': customer_ids[record['customer_id']],
+                'feature': record['feature'],
+                'quantity': record['quantity'],
+                'unit_cost': record.get('unit_cost', 0.0),
+                'timestamp': record.get('timestamp') or now,
+                'source': record.get('source', 'api')
+            })
 
-        self.db.commit()
-        return ingested
+        return self._bulk_insert(UsageEvent, rows)
 
     def ingest_revenue_data(self, revenue_records: List[Dict[str, Any]]) -> int:
         """
@@ -84,60 +145,98 @@ class DataIngestionService:
         Returns:
             Number of records ingested
         """
-        ingested = 0
+        revenue_records = _valid_records(revenue_records, _validate_revenue_record, 'revenue')
+        try:
+            customer_ids = self._resolve_customers(revenue_records)
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error resolving customers for revenue records: {e}")
+            return 0
+        # One ingestion time for the whole batch, for records without a timestamp
+        now = datetime.utcnow()
+        rows = []
         
         for record in revenue_records:
             try:
-                # Check for duplicate (idempotency)
-                existing = self.db.query(RevenueEvent).filter(
-                    RevenueEvent.external_id == record['external_id']
-                ).first()
-                
-                if existing:
-                    continue
-
-                # Get or create customer
-                customer = self._get_or_create_customer(
-                    external_id=record['customer_id'],
-                    name=record.get('customer_name', record['customer_id'])
-                )
-
-                # Create revenue event
-                revenue_event = RevenueEvent(
-                    customer_id=customer.id,
-                    amount=record['amount'],
-                    currency=record.get('currency', 'usd'),
-                    event_type=EventType[record['event_type'].upper()],
-                    external_id=record['external_id'],
-                    timestamp=record.get('timestamp', datetime.utcnow())
-                )
-                
-                self.db.add(revenue_event)
-                ingested += 1
+                rows.append({
+                    'customer_id': customer_ids[record['customer_id']],
+                    'amount': record['amount'],
+                    'currency': record.get('currency', 'usd'),
+                    'event_type': _EVENT_TYPES[record['event_type'].upper()],
+                    'external_id': record['external_id'],
+                    'timestamp': record.get('timestamp') or now
+                })
                 
-            except Exception as e:
-                logger.error(f"Error ingesting revenue record: {e}")
+            except KeyError as e:
+                logger.error(f"Error ingesting revenue record: unknown event_type {e}")
                 continue
 
-        self.db.commit()
+        return self._insert_new_revenue(rows)
+
+    def _bulk_insert(self, model, rows: List[Dict[str, Any]]) -> int:
+        """Insert rows for a model in one executemany and commit; returns rows written."""
+        try:
+            if rows:
+                self.db.execute(insert(model), rows)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error bulk inserting {model.__tablename__}: {e}")
+            return 0
+        return len(rows)
+
+    def _insert_new_revenue(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Insert revenue rows, skipping any whose external_id is already stored
+        (idempotency) via ON CONFLICT DO NOTHING; returns rows written.
+        """
+        ingested = 0
+        try:
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                stmt = dialect_insert(self.db, RevenueEvent).values(
+                    rows[start:start + INSERT_BATCH_SIZE]
+                ).on_conflict_do_nothing(index_elements=['external_id'])
+                ingested += self.db.execute(stmt).rowcount
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error bulk inserting revenue_events: {e}")
+            return 0
         return ingested
 
-    def _get_or_create_customer(self, external_id: str, name: str, plan: str = None) -> Customer:
-        """Get existing customer or create new one."""
-        customer = self.db.query(Customer).filter(
-            Customer.external_customer_id == external_id
-        ).first()
+    def _resolve_customers(self, records: List[Dict[str, Any]], plan_from_record: bool = False) -> Dict[str, int]:
+        """
+        Map every external customer id in a batch to its customer row id,
+        creating missing customers, with one lookup query and one flush.
+        Name (and plan, if plan_from_record) come from the first record per customer.
+        """
+        first_records = {}
+        for record in records:
+            external_id = record.get('customer_id')
+            if external_id is not None and external_id not in first_records:
+                first_records[external_id] = record
+
+        customer_ids = dict(self.db.execute(
+            select(Customer.external_customer_id, Customer.id).where(
+                Customer.external_customer_id.in_(first_records)
+            )
+        ).all())
 
-        if not customer:
-            customer = Customer(
+        missing = [
+            Customer(
                 external_customer_id=external_id,
-                name=name,
-                plan=plan or 'Unknown'
+                name=record.get('customer_name', external_id),
+                plan=(record.get('plan') if plan_from_record else None) or 'Unknown'
             )
-            self.db.add(customer)
-            self.db.flush()  # Get the ID without committing
+            for external_id, record in first_records.items()
+            if external_id not in customer_ids
+        ]
+        if missing:
+            self.db.add_all(missing)
+            self.db.flush()  # Get the IDs without committing
+            customer_ids.update((c.external_customer_id, c.id) for c in missing)
 
-        return customer
+        return customer_ids
 
     async def sync_from_airbyte(self) -> Dict[str, int]:
         """
@@ -151,6 +250,7 @@ class DataIngestionService:
         Returns:
             Dict with sync statistics per connection
         """
+        from starlette.concurrency import run_in_threadpool
         from app.services.airbyte_service import airbyte_service
         
         stats = {
@@ -160,29 +260,36 @@ class DataIngestionService:
         }
 
         try:
-            # Get all Airbyte connections
-            connections = await airbyte_service.list_connections()
+            # Get all Airbyte connections (blocking HTTP, so off the event loop)
+            connections = await run_in_threadpool(airbyte_service.list_connections)
+            
+            connection_ids = [c.get('id') for c in connections if c.get('id')]
             
-            for connection in connections:
-                try:
-                    connection_id = connection.get('connectionId')
-                    if not connection_id:
-                        continue
-                    
-                    # Trigger sync
-                    job_info = await airbyte_service.trigger_sync(connection_id)
-                    
-                    if job_info.get('status') == 'running':
-                        stats['connections_synced'] += 1
-                        logger.info(f"Triggered sync for connection {connection_id}")
-                    else:
-                        stats['connections_failed'] += 1
-                        logger.warning(f"Failed to sync connection {connection_id}")
-                        
-                except Exception as e:
+            # Trigger the syncs concurrently on the threadpool, at most
+            # SYNC_CONCURRENCY at a time to stay within Airbyte's rate limits;
+            # the pooled Airbyte session keeps a connection per in-flight request
+            limit = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+            async def trigger(connection_id: str) -> bool:
+                async with limit:
+                    return await run_in_threadpool(airbyte_service.trigger_sync, connection_id)
+
+            results = await asyncio.gather(
+                *(trigger(cid) for cid in connection_ids),
+                return_exceptions=True
+            )
+            
+            for connection_id, result in zip(connection_ids, results):
+                if isinstance(result, Exception):
+                    stats['connections_failed'] += 1
+                    logger.error(f"Error syncing connection {connection_id}: {result}")
+                elif result:
+                    stats['connections_synced'] += 1
+                    logger.info(f"Triggered sync for connection {connection_id}")
+                else:
                     stats['connections_failed'] += 1
-                    logger.error(f"Error syncing connection: {e}")
-                    
+                    logger.warning(f"Failed to sync connection {connection_id}")
+
         except Exception as e:
             logger.error(f"Error listing Airbyte connections: {e}")
         
@@ -197,25 +304,21 @@ class DataIngestionService:
             start_dt = datetime.fromisoformat(start_date)
             end_dt = datetime.fromisoformat(end_date)
             
-            # Count usage events
-            usage_count = self.db.query(UsageEvent).filter(
-                UsageEvent.timestamp >= start_dt,
-                UsageEvent.timestamp <= end_dt
-            ).count()
-            
-            # Count revenue events
-            revenue_count = self.db.query(RevenueEvent).filter(
-                RevenueEvent.timestamp >= start_dt,
-                RevenueEvent.timestamp <= end_dt
-            ).count()
-            
-            # Count customers
-            customer_count = self.db.query(Customer).count()
+            # All three counts as scalar subqueries in one round-trip
+            counts = self.db.execute(select(
+                select(func.count()).select_from(UsageEvent).where(
+                    UsageEvent.timestamp.between(start_dt, end_dt)
+                ).scalar_subquery().label('usage_count'),
+                select(func.count()).select_from(RevenueEvent).where(
+                    RevenueEvent.timestamp.between(start_dt, end_dt)
+                ).scalar_subquery().label('revenue_count'),
+                select(func.count()).select_from(Customer).scalar_subquery().label('customer_count'),
+            )).one()
             
             return {
-                'usage_events': usage_count,
-                'revenue_events': revenue_count,
-                'total_customers': customer_count,
+                'usage_events': counts.usage_count,
+                'revenue_events': counts.revenue_count,
+                'total_customers': counts.customer_count,
                 'date_range': f"{start_date} to {end_date}"
             }
             
@@ -1,21 +1,46 @@
 """Background scheduler for periodic data aggregation and insight computation."""
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timedelta
 import logging
 
+from app.config import settings
 from app.database import SessionLocal
 from app.services.data_ingestion_service import DataIngestionService
 from app.services.aggregation_service import AggregationService
 
 logger = logging.getLogger(__name__)
 
+# Threads (and so DB connections) shared by the synchronous aggregation jobs
+DB_JOB_WORKERS = 2
+
+# How late a scheduled run may still start (e.g. after a stalled process)
+MISFIRE_GRACE_SECONDS = 600
+
 
 class SchedulerService:
     """Manages scheduled tasks for data processing."""
 
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
+        # Runs on the app's event loop once started from the FastAPI startup
+        # hook: coroutine jobs are awaited there. The DB-bound jobs run on a
+        # small dedicated pool, so at most DB_JOB_WORKERS of the engine's
+        # pooled connections go to background work and requests keep the rest.
+        # A job still running when it is next due is skipped, not doubled;
+        # fires missed while the process was stalled collapse into one run,
+        # and are dropped once more than MISFIRE_GRACE_SECONDS late.
+        self.scheduler = AsyncIOScheduler(
+            executors={
+                'default': AsyncIOExecutor(),
+                'db': ThreadPoolExecutor(max_workers=DB_JOB_WORKERS)
+            },
+            job_defaults={
+                'coalesce': True,
+                'max_instances': 1,
+                'misfire_grace_time': MISFIRE_GRACE_SECONDS
+            }
+        )
         self._setup_jobs()
 
     def _setup_jobs(self):
@@ -30,12 +55,25 @@ class SchedulerService:
             replace_existing=True
         )
 
-        # Materialize daily aggregates at 2 AM
+        # Fold newly ingested events into the daily aggregates every few
+        # minutes, so each run only touches the events since the last one
         self.scheduler.add_job(
             func=self.materialize_aggregates,
-            trigger=CronTrigger(hour=2, minute=0),  # Daily at 2 AM
+            trigger=CronTrigger(minute=f'*/{settings.AGGREGATION_REFRESH_MINUTES}'),
             id='materialize_aggregates',
-            name='Materialize daily aggregates',
+            executor='db',
+            name='Refresh daily aggregates',
+            replace_existing=True
+        )
+
+        # Weekly full rebuild as a safety net for anything the incremental
+        # refresh missed (e.g. events committed out of id order)
+        self.scheduler.add_job(
+            func=self.rebuild_aggregates,
+            trigger=CronTrigger(day_of_week='sun', hour=settings.AGGREGATION_HOUR, minute=0),
+            id='rebuild_aggregates',
+            executor='db',
+            name='Rebuild daily aggregates',
             replace_existing=True
         )
 
@@ -44,6 +82,7 @@ class SchedulerService:
             func=self.compute_insights,
             trigger=CronTrigger(hour='*/6'),  # Every 6 hours
             id='compute_insights',
+            executor='db',
             name='Compute rule-based insights',
             replace_existing=True
         )
@@ -63,28 +102,42 @@ class SchedulerService:
             db.close()
 
     def materialize_aggregates(self):
-        """Materialize daily aggregates for yesterday."""
-        logger.info("Starting daily aggregate materialization...")
+        """Apply events ingested since the last run to the daily aggregates."""
+        logger.info("Starting daily aggregate refresh...")
         db = SessionLocal()
         try:
             aggregation_service = AggregationService(db)
-            
-            # Materialize for yesterday
-            yesterday = datetime.now() - timedelta(days=1)
-            count = aggregation_service.materialize_daily_aggregates(yesterday)
-            logger.info(f"Materialized {count} daily aggregates for {yesterday.date()}")
+            count = aggregation_service.refresh_daily_aggregates()
+            logger.info(f"Applied {count} new events to daily aggregates")
             
         except Exception as e:
             logger.error(f"Error materializing aggregates: {e}")
         finally:
             db.close()
 
+    def rebuild_aggregates(self):
+        """Recompute all daily aggregates from the raw events."""
+        logger.info("Starting daily aggregate rebuild...")
+        db = SessionLocal()
+        try:
+            aggregation_service = AggregationService(db)
+            count = aggregation_service.rebuild_daily_aggregates()
+            logger.info(f"Rebuilt daily aggregates ({count} new rows)")
+            
+        except Exception as e:
+            logger.error(f"Error rebuilding aggregates: {e}")
+        finally:
+            db.close()
+
     def compute_insights(self):
         """Compute insights."""
         logger.info("Computing insights...")
         db = SessionLocal()
         try:
             aggregation_service = AggregationService(db)
+            if not aggregation_service.insights_stale():
+                logger.info("Aggregates unchanged since the last run; skipping insights")
+                return
             count = aggregation_service.compute_insights()
             logger.info(f"Generated {count} new insights")
             
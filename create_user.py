@@ -6,6 +6,11 @@ import os
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
+# The demo password is public anyway, so hash it cheaply; the app rehashes it
+# with the full parameters on first login
+os.environ.setdefault("ARGON2_TIME_COST", "1")
+os.environ.setdefault("ARGON2_MEMORY_COST", "8192")
+
 from app.database import init_db, SessionLocal
 from app.models.db_models import User
 from app.auth import get_password_hash
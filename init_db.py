@@ -4,7 +4,6 @@
 import sys
 import os
 import asyncio
-from datetime import datetime, timedelta
 
 # Add app directory to path
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
@@ -30,9 +29,11 @@ async def main():
         print("   - Airbyte will automatically sync data to the database")
         print("   - Use POST /api/sync to trigger manual syncs")
         
+        # Every day with events, bulk-upserted in one transaction; also sets the
+        # watermarks so the scheduler's first refresh is incremental
         print("\nMaterializing initial aggregates...")
         aggregation_service = AggregationService(db)
-        agg_count = aggregation_service.materialize_daily_aggregates(datetime.now())
+        agg_count = aggregation_service.rebuild_daily_aggregates()
         print(f"   - Created {agg_count} aggregate records")
         
         print("\nComputing insights...")